@@ -0,0 +1,1146 @@
+import json
+import os
+import threading
+import weakref
+from math import atan2, pi
+import numpy as np
+
+
+# -------- Sparse transition counts N(s,s') --------
+class _SparseCounts:
+    """
+    COO count matrix of shape (n, ncols), square by default: new (s, s') hits go to an append
+    buffer and are merged into sorted unique keys (s * ncols + s') on compaction.
+    """
+
+    def __init__(self, n, buf=4096, ncols=None):
+        self.n = int(n)
+        self.m = int(ncols) if ncols is not None else self.n
+        self.keys = np.zeros((0,), dtype=np.int64)     # sorted s * m + s'
+        self.vals = np.zeros((0,), dtype=np.float32)   # N(s,s') for each key
+        self._buf_k = np.empty((buf,), dtype=np.int64)
+        self._buf_v = np.empty((buf,), dtype=np.float32)
+        self._nbuf = 0
+        self.journal = None                              # list of compacted hits since drain(), when tracked
+
+    @property
+    def nnz(self):
+        self.compact()
+        return int(self.keys.size)
+
+    def add(self, i, j, c=1.0):
+        if self._nbuf == self._buf_k.size:
+            self.compact()
+        self._buf_k[self._nbuf] = int(i) * self.m + int(j)
+        self._buf_v[self._nbuf] = c
+        self._nbuf += 1
+
+    def add_many(self, i, j, c=1.0):
+        """Batched add(): one hit per (i[k], j[k]) pair, duplicates allowed."""
+        k = np.asarray(i, np.int64) * self.m + np.asarray(j, np.int64)
+        if self._nbuf + k.size > self._buf_k.size:
+            self.compact()
+            if k.size > self._buf_k.size:
+                self._buf_k = np.empty((2 * k.size,), dtype=np.int64)
+                self._buf_v = np.empty((2 * k.size,), dtype=np.float32)
+        self._buf_k[self._nbuf:self._nbuf + k.size] = k
+        self._buf_v[self._nbuf:self._nbuf + k.size] = c
+        self._nbuf += k.size
+
+    def compact(self):
+        """Merge buffered hits into the sorted key/value arrays."""
+        if self._nbuf == 0:
+            return
+        if self.journal is not None:
+            self.journal.append((self._buf_k[:self._nbuf].copy(), self._buf_v[:self._nbuf].copy()))
+        k = np.concatenate((self.keys, self._buf_k[:self._nbuf]))
+        v = np.concatenate((self.vals, self._buf_v[:self._nbuf]))
+        self.keys, inv = np.unique(k, return_inverse=True)
+        self.vals = np.bincount(inv, weights=v).astype(np.float32)
+        self._nbuf = 0
+
+    def drain(self):
+        """Merged (keys, counts) added since the last drain(); needs journal tracking enabled."""
+        self.compact()
+        parts, self.journal = self.journal or [], []
+        if not parts:
+            return np.zeros((0,), np.int64), np.zeros((0,), np.float32)
+        k, inv = np.unique(np.concatenate([p[0] for p in parts]), return_inverse=True)
+        v = np.bincount(inv, weights=np.concatenate([p[1] for p in parts])).astype(np.float32)
+        return k, v
+
+    def rows_cols(self):
+        self.compact()
+        return self.keys // self.m, self.keys % self.m
+
+    def row_sums(self):
+        """∑_s' N(s,s') for every s, shape (n,)."""
+        rows, _ = self.rows_cols()
+        return np.bincount(rows, weights=self.vals, minlength=self.n).astype(np.float32)
+
+    def get(self, i, j):
+        self.compact()
+        k = int(i) * self.m + int(j)
+        pos = int(np.searchsorted(self.keys, k))
+        if pos < self.keys.size and self.keys[pos] == k:
+            return float(self.vals[pos])
+        return 0.0
+
+    def block(self, idx):
+        """Dense N[idx][:, idx] for an array of state indices."""
+        rows, cols = self.rows_cols()
+        loc = np.full((max(self.n, self.m),), -1, dtype=np.int64)
+        loc[idx] = np.arange(len(idx))
+        keep = (loc[rows] >= 0) & (loc[cols] >= 0)
+        out = np.zeros((len(idx), len(idx)), dtype=np.float32)
+        out[loc[rows[keep]], loc[cols[keep]]] = self.vals[keep]
+        return out
+
+    def toarray(self):
+        return self.block(np.arange(self.n))
+
+    def copy(self):
+        self.compact()
+        out = _SparseCounts(self.n, buf=self._buf_k.size, ncols=self.m)
+        out.keys = self.keys.copy()
+        out.vals = self.vals.copy()
+        return out
+
+    @classmethod
+    def from_triplets(cls, n, rows, cols, vals, ncols=None):
+        out = cls(n, ncols=ncols)
+        out.keys = np.asarray(rows, np.int64) * out.m + np.asarray(cols, np.int64)
+        out.vals = np.asarray(vals, np.float32)
+        order = np.argsort(out.keys, kind="stable")
+        out.keys, out.vals = out.keys[order], out.vals[order]
+        return out
+
+
+# -------- Background value solve --------
+class _BackgroundSolve:
+    """
+    Runs one solve at a time in a daemon thread. submit() is refused while a solve is still
+    running and counted in `dropped`; poll() hands the finished (tag, result) back once, on the
+    caller's thread, and re-raises there an exception the solve ended with. cancel() discards the
+    result of every solve submitted before it.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._done = None
+        self._error = None
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, fn, args, tag=None):
+        if self.busy():
+            self.dropped += 1
+            return False
+        epoch = self._epoch
+
+        def run():
+            try:
+                out = fn(*args)
+            except Exception as e:
+                with self._lock:
+                    self._error = e
+                return
+            with self._lock:
+                if epoch == self._epoch:
+                    self._done = (tag, out)
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        return True
+
+    def poll(self):
+        with self._lock:
+            done, self._done = self._done, None
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+        return done
+
+    def cancel(self):
+        with self._lock:
+            self._epoch += 1
+            self._done = None
+
+
+# -------- Per-agent columns --------
+class _AgentTable:
+    """
+    Struct-of-arrays keyed by robot id: one NumPy column per field, one row per agent.
+    Rows are handed out on first sight; columns double in length when full.
+    """
+
+    def __init__(self, columns, cap=16):
+        self._spec = dict(columns)                    # name -> (dtype, fill value)
+        self._cap = int(cap)
+        self.rows = {}                                # robot id -> row
+        self.n = 0
+        self._cols = {k: np.full((self._cap,), fill, dtype=dt) for k, (dt, fill) in self._spec.items()}
+
+    def row(self, rid):
+        r = self.rows.get(rid)
+        if r is None:
+            if self.n == self._cap:
+                self._grow()
+            r = self.n
+            self.rows[rid] = r
+            self.n += 1
+        return r
+
+    def _grow(self):
+        cap = 2 * self._cap
+        for k, (dt, fill) in self._spec.items():
+            col = np.full((cap,), fill, dtype=dt)
+            col[:self._cap] = self._cols[k]
+            self._cols[k] = col
+        self._cap = cap
+
+    def __getitem__(self, name):
+        """Live view of one column over the registered agents."""
+        return self._cols[name][:self.n]
+
+    def ids(self):
+        out = [None] * self.n
+        for rid, r in self.rows.items():
+            out[r] = rid
+        return out
+
+    def columns(self):
+        """Copies of every column over the registered agents, plus their robot ids under "id"."""
+        out = {k: col[:self.n].copy() for k, col in self._cols.items()}
+        out["id"] = np.array(self.ids(), dtype=np.int64)
+        return out
+
+    def reset(self):
+        """Every column back to its fill value; robots keep their rows."""
+        for k, (dt, fill) in self._spec.items():
+            self._cols[k][:] = fill
+
+    def restore(self, ids, columns):
+        """
+        Overwrite the rows of robots `ids` (added if new) with saved column values; other rows
+        and rows already handed out keep their index. Columns missing from `columns` are left alone.
+        """
+        rows = np.array([self.row(int(rid)) for rid in ids], dtype=np.int64)
+        for k, col in columns.items():
+            if col is not None and k in self._cols:
+                self._cols[k][rows] = col
+
+
+# -------- Checkpoint directory --------
+_LOG_DTYPE = np.dtype([("k", "<i8"), ("c", "<f4")])   # one N(s,s') delta record
+
+
+def _fsync_dir(path):
+    # a rename is only durable once the directory holding it is synced (POSIX; Windows has no directory handles)
+    if os.name != "posix":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path, write):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+class _Checkpoint:
+    """
+    ADP tables on disk.
+    live_<name>.npy   np.memmap tables the learner writes to; readers: np.load(path, mmap_mode="r")
+    <name>.<g>.npy    dense snapshots of commit generation g
+    <name>.<t>.log    append-only deltas of one count table; only meta["<name>_len"] records are committed
+    meta.json         commit point, replaced atomically after everything it names is on disk
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.meta = None
+        if os.path.isfile(self._p("meta.json")):
+            with open(self._p("meta.json"), "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+
+    def _p(self, name):
+        return os.path.join(self.root, name)
+
+    def live(self, name, shape, dtype, fill=0):
+        """
+        Memory-mapped live table, reset to the last committed snapshot (`fill` if none). An existing
+        file of the same shape is reused in place, and a new one is built aside and renamed over the
+        old, so a reader that has the file mapped is never left with a truncated mapping.
+        """
+        path = self._p(f"live_{name}.npy")
+        arr = None
+        if os.path.isfile(path):
+            try:
+                arr = np.lib.format.open_memmap(path, mode="r+")
+            except (ValueError, OSError):          # not a readable .npy: replace it
+                arr = None
+            if arr is not None and (arr.shape != tuple(shape) or arr.dtype != np.dtype(dtype)):
+                arr = None
+        if arr is None:
+            arr = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=dtype, shape=shape)
+            os.replace(path + ".tmp", path)
+        saved = self.load(name)
+        arr[:] = saved if saved is not None else fill
+        return arr
+
+    def load(self, name):
+        """Committed snapshot of a table passed to commit(), or None."""
+        if self.meta is None or not os.path.isfile(self._p(f"{name}.{self.meta['gen']}.npy")):
+            return None
+        return np.load(self._p(f"{name}.{self.meta['gen']}.npy"))
+
+    def load_counts(self, counts, name="trans"):
+        """Replay the committed log of count table `name` into an empty _SparseCounts."""
+        if self.meta is not None and self.meta.get(f"{name}_len", 0) > 0:
+            rec = np.fromfile(self._p(f"{name}.{self.meta[f'{name}_gen']}.log"), dtype=_LOG_DTYPE,
+                              count=self.meta[f"{name}_len"])
+            counts.add_many(rec["k"] // counts.m, rec["k"] % counts.m, rec["c"])
+            counts.compact()
+        counts.journal = []
+        return counts
+
+    def commit(self, dense, counts, **extra):
+        """
+        Write one consistent generation: dense snapshots, new log records of every count table
+        in `counts` (name -> _SparseCounts), then meta.json.
+        """
+        old = self.meta or {"gen": -1}
+        gen = old["gen"] + 1
+        logs, stale = {}, []
+        for name, c in counts.items():
+            tgen, tlen = old.get(f"{name}_gen", 0), old.get(f"{name}_len", 0)
+            untracked = c.journal is None                  # e.g. replaced wholesale since the last commit
+            k, v = c.drain()
+            if untracked or tlen + k.size > 4 * max(c.nnz, 1024):
+                # log mostly superseded deltas (or stale): rewrite it compacted under a new name
+                stale.append(f"{name}.{tgen}.log")
+                tgen, tlen = tgen + 1, c.nnz
+                rec = np.empty((tlen,), dtype=_LOG_DTYPE)
+                rec["k"], rec["c"] = c.keys, c.vals
+                _atomic_write(self._p(f"{name}.{tgen}.log"), rec.tofile)
+            elif k.size:
+                rec = np.empty((k.size,), dtype=_LOG_DTYPE)
+                rec["k"], rec["c"] = k, v
+                with open(self._p(f"{name}.{tgen}.log"), "ab") as f:
+                    f.truncate(tlen * _LOG_DTYPE.itemsize)     # drop records a crash left uncommitted
+                    rec.tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                tlen += k.size
+            logs[f"{name}_gen"], logs[f"{name}_len"] = tgen, tlen
+        for name, arr in dense.items():
+            if isinstance(arr, np.memmap):
+                arr.flush()
+            _atomic_write(self._p(f"{name}.{gen}.npy"), lambda f, a=arr: np.save(f, np.asarray(a)))
+        meta = dict(extra, gen=gen, **logs)
+        _atomic_write(self._p("meta.json"), lambda f: f.write(json.dumps(meta).encode("utf-8")))
+        self.meta = meta
+        # older generations are unreachable from meta.json now
+        for name in dense:
+            if os.path.isfile(self._p(f"{name}.{old['gen']}.npy")):
+                os.remove(self._p(f"{name}.{old['gen']}.npy"))
+        for name in stale:
+            if os.path.isfile(self._p(name)):
+                os.remove(self._p(name))
+
+
+# -------- Active ADP: (state, action) model --------
+def _policy_tables(qtrans, qvis, qRsum, pi, n_actions):
+    """
+    Fold N(s,a,s') (rows s * n_actions + a) into state tables (trans, vis, Rsum) for policy pi.
+    States with pi[s] < 0 keep every action tried there, i.e. the policy that was actually run.
+    """
+    n_states = pi.size
+    rows, cols = qtrans.rows_cols()
+    s, a = rows // n_actions, rows % n_actions
+    keep = (pi[s] < 0) | (a == pi[s])
+    trans = _SparseCounts(n_states)
+    trans.add_many(s[keep], cols[keep], qtrans.vals[keep])
+    trans.compact()
+    take = (pi[:, None] < 0) | (np.arange(n_actions)[None, :] == pi[:, None])   # (S, A)
+    vis = (qvis.reshape(n_states, n_actions) * take).sum(1).astype(np.int32)
+    Rsum = (qRsum.reshape(n_states, n_actions) * take).sum(1).astype(np.float32)
+    return trans, vis, Rsum
+
+
+def _greedy_policy(qtrans, qvis, qRsum, V, gamma, pi):
+    """
+    Batched Bellman backup Q(s,a) = R(s,a) + γ ∑_s' P(s'|s,a) V(s') over every tried (s,a),
+    then argmax_a Q. Untried actions never win; states with nothing tried, or whose current
+    action is still among the best, keep pi[s].
+    """
+    n_states = pi.size
+    rows, cols = qtrans.rows_cols()
+    PV = np.bincount(rows, weights=qtrans.vals * V[cols], minlength=qtrans.n) / np.maximum(qtrans.row_sums(), 1)
+    Q = (qRsum / np.maximum(qvis, 1) + gamma * PV).reshape(n_states, -1)
+    Q[(qvis == 0).reshape(n_states, -1)] = -np.inf
+    q_best = Q.max(1)
+    new = pi.copy()
+    tried = np.isfinite(q_best)
+    stay = (pi >= 0) & (Q[np.arange(n_states), np.maximum(pi, 0)] >= q_best - 1e-6)
+    upd = tried & ~stay
+    new[upd] = Q[upd].argmax(1)
+    return new
+
+
+# -------- LSTD value estimate --------
+class _LSTD:
+    """
+    LSTD(0) over features of x = (dist, dth, e_r): bias, dist, and a grid of Gaussian RBFs
+    over (dth, e_r), with dth differences wrapped. B = A^-1 is kept current with Sherman-Morrison,
+    so each transition costs O(k^2) and there is no model over states at all.
+    """
+
+    def __init__(self, gamma, d_max, n_th=8, n_er=7, reg=0.1):
+        th_c = np.linspace(-np.pi, np.pi, n_th, endpoint=False)
+        er_c = np.linspace(-d_max, d_max, n_er)
+        self.c_th, self.c_er = [g.reshape(-1) for g in np.meshgrid(th_c, er_c, indexing="ij")]
+        self.w_th = 2 * np.pi / n_th                 # RBF widths = grid spacing
+        self.w_er = 2 * d_max / (n_er - 1)
+        self.k = 2 + self.c_th.size
+        self.gamma = gamma
+        self.A = reg * np.eye(self.k)
+        self.B = np.eye(self.k) / reg
+        self.b = np.zeros((self.k,))
+        self._theta = None
+
+    def features(self, x):
+        """x: (3,) or (N, 3) rows of (dist, dth, e_r) -> (k,) or (N, k)."""
+        x = np.asarray(x, np.float64)
+        X = x.reshape(-1, 3)
+        d_th = (X[:, 1:2] - self.c_th + np.pi) % (2 * np.pi) - np.pi
+        d_er = X[:, 2:3] - self.c_er
+        rbf = np.exp(-0.5 * ((d_th / self.w_th) ** 2 + (d_er / self.w_er) ** 2))
+        phi = np.concatenate((np.ones((X.shape[0], 1)), X[:, 0:1], rbf), axis=1)
+        return phi[0] if x.ndim == 1 else phi
+
+    def update(self, x, r, x_next):
+        """One transition x -> x_next with reward r."""
+        u = self.features(x)
+        v = u - self.gamma * self.features(x_next)
+        Bu = self.B @ u
+        vB = v @ self.B
+        self.B -= np.outer(Bu, vB) / (1.0 + vB @ u)
+        self.A += np.outer(u, v)
+        self.b += r * u
+        self._theta = None
+
+    def update_many(self, X, r, X_next):
+        """N transitions at once: Woodbury while N < k, otherwise one re-inversion of A."""
+        U = self.features(X).reshape(-1, self.k)
+        if U.shape[0] == 0:
+            return
+        W = U - self.gamma * self.features(X_next).reshape(-1, self.k)
+        self.A += U.T @ W
+        self.b += U.T @ np.asarray(r, np.float64).reshape(-1)
+        if U.shape[0] < self.k:
+            BU = self.B @ U.T                              # (k, N)
+            WB = W @ self.B                                # (N, k)
+            self.B -= BU @ np.linalg.solve(np.eye(U.shape[0]) + WB @ U.T, WB)
+        else:
+            self.B = np.linalg.inv(self.A)
+        self._theta = None
+
+    @property
+    def theta(self):
+        if self._theta is None:
+            self._theta = self.B @ self.b
+        return self._theta
+
+    def value(self, x):
+        return self.features(x) @ self.theta
+
+
+# -------- Adaptive (dist, dth) partition --------
+class _KDPartition:
+    """
+    k-d partition of [0, d_max] x [-pi, pi) used as the ADP state index.
+    The box is cut into a 2^levels x 2^levels grid of fine cells; leaves are aligned rectangles
+    of cells. refine() halves the longer side of every leaf visited at least split_at times,
+    busiest first, until max_leaves leaves exist. leaf_of maps cell -> leaf (= state index).
+    """
+
+    def __init__(self, d_max, levels, max_leaves, split_at):
+        self.d_max = float(d_max)
+        self.g = 1 << int(levels)
+        self.max_leaves = int(max_leaves)
+        self.split_at = split_at
+        self.leaf_of = np.zeros((self.g * self.g,), dtype=np.int64)
+        self.box = np.zeros((self.max_leaves, 4), dtype=np.int64)   # i0, i1 (dist) / j0, j1 (dth) in cells
+        self.box[0] = (0, self.g, 0, self.g)
+        self.n = 1
+
+    def cell(self, dist, dth):
+        fi = int(np.clip(dist / self.d_max * self.g, 0, self.g - 1))
+        ti = int(np.clip(np.floor((dth + np.pi) / (2 * np.pi) * self.g), 0, self.g - 1))
+        return fi * self.g + ti
+
+    def cells(self, dist, dth):   # cell() over arrays
+        fi = np.clip(dist / self.d_max * self.g, 0, self.g - 1).astype(np.int64)
+        ti = np.clip(np.floor((dth + np.pi) / (2 * np.pi) * self.g), 0, self.g - 1).astype(np.int64)
+        return fi * self.g + ti
+
+    def refine(self, cell_vis):
+        """Split busy leaves once each; returns the new (parent, child) pairs."""
+        counts = np.bincount(self.leaf_of, weights=cell_vis, minlength=self.max_leaves)
+        grid = self.leaf_of.reshape(self.g, self.g)
+        out = []
+        for leaf in np.argsort(-counts[:self.n], kind="stable"):
+            if self.n == self.max_leaves or counts[leaf] < self.split_at:
+                break
+            i0, i1, j0, j1 = self.box[leaf]
+            if i1 - i0 >= j1 - j0 and i1 - i0 > 1:
+                m = (i0 + i1) // 2
+                self.box[leaf], self.box[self.n] = (i0, m, j0, j1), (m, i1, j0, j1)
+                grid[m:i1, j0:j1] = self.n
+            elif j1 - j0 > 1:
+                m = (j0 + j1) // 2
+                self.box[leaf], self.box[self.n] = (i0, i1, j0, m), (i0, i1, m, j1)
+                grid[i0:i1, m:j1] = self.n
+            else:
+                continue
+            out.append((int(leaf), self.n))
+            self.n += 1
+        return out
+
+    def restore(self, leaf_of, box):
+        """Reinstate a saved partition: its leaf_of and the boxes of its leaves in use."""
+        self.leaf_of[:] = leaf_of
+        self.box[:len(box)] = box
+        self.n = len(box)
+
+
+# -------- Peer spatial hash --------
+class _SpatialHash:
+    """
+    Uniform grid over peer positions: cell -> set of keys, plus one (M, 2) array of positions.
+    nearest() searches rings of cells outwards and is exact; when the rings would cover more cells
+    than are occupied it finishes with one vectorized pass over the array instead.
+    """
+
+    def __init__(self, cell):
+        self.cell = float(cell)
+        self.slot = {}                                 # key -> row in xy
+        self.xy = np.zeros((0, 2), dtype=np.float64)
+        self.cells = {}
+
+    def _c(self, x, y):
+        return (int(np.floor(x / self.cell)), int(np.floor(y / self.cell)))
+
+    def rebuild(self, items):
+        """items: iterable of (key, x, y)."""
+        items = list(items)
+        self.slot = {k: i for i, (k, _, _) in enumerate(items)}
+        self.xy = np.array([(x, y) for _, x, y in items], dtype=np.float64).reshape(-1, 2)
+        self.cells = {}
+        for k, x, y in items:
+            self.cells.setdefault(self._c(x, y), set()).add(k)
+
+    def move(self, k, x, y):
+        i = self.slot.get(k)
+        if i is None:
+            i = self.slot[k] = len(self.slot)
+            if i == self.xy.shape[0]:
+                self.xy = np.concatenate((self.xy, np.zeros((max(i, 8), 2))))
+        else:
+            c = self._c(*self.xy[i])
+            if c == self._c(x, y):
+                self.xy[i] = (x, y)
+                return
+            self.cells[c].discard(k)
+            if not self.cells[c]:
+                del self.cells[c]
+        self.xy[i] = (x, y)
+        self.cells.setdefault(self._c(x, y), set()).add(k)
+
+    def nearest(self, x, y, skip=None):
+        """Distance to the closest stored point other than `skip`, or None."""
+        n = len(self.slot)
+        if n - (skip in self.slot) <= 0:
+            return None
+        cx, cy = self._c(x, y)
+        best = float("inf")
+        r = 0
+        while (2 * r + 1) ** 2 <= 4 * len(self.cells):
+            for i in range(-r, r + 1):
+                step = 1 if abs(i) == r else 2 * r     # whole column on the ring's sides, two ends inside
+                for j in range(-r, r + 1, max(step, 1)):
+                    for k in self.cells.get((cx + i, cy + j), ()):
+                        if k != skip:
+                            ox, oy = self.xy[self.slot[k]]
+                            d = np.hypot(ox - x, oy - y)
+                            if d < best:
+                                best = d
+            # every unvisited cell is at least r * cell away
+            if best <= r * self.cell:
+                return best
+            r += 1
+        d = np.hypot(self.xy[:n, 0] - x, self.xy[:n, 1] - y)
+        if skip in self.slot:
+            d[self.slot[skip]] = np.inf
+        return d.min()
+
+
+# -------- RL_passive learner shared by custom_behavior_methods_1 and _2 --------
+# `cfg` is the calling behavior module. Its globals (_S, _A, _ACTIONS, BIN_D, BIN_TH, D_MAX, _GAMMA, _V0, _KW,
+# _KR, _Thres, _AG_COLUMNS, _ADP_*, _PARTITION, _PART_*, _CKPT_*) are read where they are used, so a value
+# set after import applies from then on (tables already allocated keep their size).
+class _ADPContext:
+    """The ADP tables, agent table and solver RL_passive keeps for one irsim environment."""
+
+    def __init__(self, cfg):
+        if cfg._ADP_ESTIMATOR == "lstd" and cfg._ADP_MODE == "active":
+            raise ValueError("_ADP_ESTIMATOR='lstd' only evaluates the policy being run, so _ADP_MODE='active' "
+                             "would never improve it; use the 'table' estimator for active mode")
+        self.cfg = cfg
+        S, A = cfg._S, cfg._A
+        # ADP statistics
+        self.trans = _SparseCounts(S)                       # N(s,s'), sparse: grows with visited transitions
+        self.vis   = np.zeros((S,), dtype=np.int32)        # N(s)
+        self.Rsum  = np.zeros((S,), dtype=np.float32)      # ∑r(s)
+        self.V     = np.zeros((S,), dtype=np.float32)      # estimated V(s)
+        self.AG = _AgentTable(cfg._AG_COLUMNS)
+        self.step = 0                 # fleet-wide RL_passive calls, drives the _ADP_EVERY cadence
+        self.V_step = 0               # step at which the counts behind V were taken
+        self.solver = _BackgroundSolve()
+        self.lstd = _LSTD(cfg._GAMMA, cfg.D_MAX)
+        # adaptive partition, with counts per fine cell so the leaf tables can be rebuilt
+        self.part = _KDPartition(cfg.D_MAX, levels=cfg._PART_LEVELS, max_leaves=S, split_at=cfg._PART_SPLIT)
+        self.fvis   = np.zeros((self.part.g ** 2,), dtype=np.int32)
+        self.fRsum  = np.zeros((self.part.g ** 2,), dtype=np.float32)
+        self.ftrans = _SparseCounts(self.part.g ** 2)
+        # active mode
+        self.qtrans = _SparseCounts(S * A, ncols=S)         # N(s,a,s'), row s * A + a
+        self.qvis   = np.zeros((S * A,), dtype=np.int32)    # N(s,a)
+        self.qRsum  = np.zeros((S * A,), dtype=np.float32)
+        self.pi     = np.full((S,), -1, dtype=np.int64)    # greedy action per state, -1: not improved yet (fixed policy)
+        self.ckpt = None
+
+
+class _Contexts:
+    """
+    irsim environment -> context made by `make()`, dropped with the environment. Robots without an
+    environment (built by hand) share `default`; `last` is the context of the latest call, which
+    metrics_p() and passive_*() fall back to.
+    """
+
+    def __init__(self, make):
+        self._make = make
+        self._by_env = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.default = make()
+        self.last = self.default
+
+    def of_env(self, env):
+        if env is None:
+            return self.default
+        ctx = self._by_env.get(env)
+        if ctx is None:
+            with self._lock:
+                ctx = self._by_env.get(env)
+                if ctx is None:
+                    ctx = self._by_env[env] = self._make()
+        return ctx
+
+    def of_ego(self, ego):
+        self.last = self.of_env(getattr(ego, "_env", None))
+        return self.last
+
+    def of(self, env=None):
+        """Context of `env`, or of the environment that ran last."""
+        return self.last if env is None else self.of_env(env)
+
+
+def _passive_save(ctx, path):
+    # written to a temporary file and renamed, so a crash never leaves a half-written file behind
+    cfg = ctx.cfg
+    rows, cols = ctx.trans.rows_cols()
+    qrows, qcols = ctx.qtrans.rows_cols()
+    _atomic_write(path, lambda f: np.savez(f, V=ctx.V, trans_rows=rows, trans_cols=cols, trans_vals=ctx.trans.vals,
+                                           vis=ctx.vis, Rsum=ctx.Rsum, bins_d=cfg.BIN_D, bins_th=cfg.BIN_TH,
+                                           dmax=cfg.D_MAX, qtrans_rows=qrows, qtrans_cols=qcols,
+                                           qtrans_vals=ctx.qtrans.vals, qvis=ctx.qvis, qRsum=ctx.qRsum, pi=ctx.pi,
+                                           n_actions=cfg._A, partition=cfg._PARTITION, **_part_tables(ctx)))
+
+
+def _part_tables(ctx):
+    # adaptive partition: the leaves and the per-cell counts the leaf tables are rebuilt from
+    if ctx.cfg._PARTITION != "adaptive":
+        return {}
+    rows, cols = ctx.ftrans.rows_cols()
+    return dict(part_levels=ctx.cfg._PART_LEVELS, part_leaf_of=ctx.part.leaf_of, part_box=ctx.part.box[:ctx.part.n],
+                fvis=ctx.fvis, fRsum=ctx.fRsum, ftrans_rows=rows, ftrans_cols=cols, ftrans_vals=ctx.ftrans.vals)
+
+
+def _passive_load(ctx, path):
+    cfg = ctx.cfg
+    S, A = cfg._S, cfg._A
+    with np.load(path) as d:
+        if (int(d["bins_d"]), int(d["bins_th"])) != (cfg.BIN_D, cfg.BIN_TH):
+            raise ValueError(f"{path}: saved with {int(d['bins_d'])}x{int(d['bins_th'])} bins, "
+                             f"module uses {cfg.BIN_D}x{cfg.BIN_TH}")
+        saved = str(d["partition"]) if "partition" in d else "uniform"
+        if saved != cfg._PARTITION or ("part_levels" in d and int(d["part_levels"]) != cfg._PART_LEVELS):
+            raise ValueError(f"{path}: saved with the {saved} partition, module uses {cfg._PARTITION}"
+                             f" ({cfg._PART_LEVELS} levels)")
+        ctx.V[:] = d["V"]
+        ctx.vis[:] = d["vis"]
+        ctx.Rsum[:] = d["Rsum"]
+        ctx.trans = _SparseCounts.from_triplets(S, d["trans_rows"], d["trans_cols"], d["trans_vals"])
+        if "qvis" in d:                  # (state, action) tables, absent from files of older versions
+            if int(d["n_actions"]) != A:
+                raise ValueError(f"{path}: saved with {int(d['n_actions'])} actions, module uses {A}")
+            ctx.qvis[:] = d["qvis"]
+            ctx.qRsum[:] = d["qRsum"]
+            ctx.pi[:] = d["pi"]
+            ctx.qtrans = _SparseCounts.from_triplets(S * A, d["qtrans_rows"], d["qtrans_cols"], d["qtrans_vals"],
+                                                     ncols=S)
+        if "part_leaf_of" in d:
+            ctx.part.restore(d["part_leaf_of"], d["part_box"])
+            ctx.fvis[:] = d["fvis"]
+            ctx.fRsum[:] = d["fRsum"]
+            ctx.ftrans = _SparseCounts.from_triplets(ctx.part.g ** 2, d["ftrans_rows"], d["ftrans_cols"], d["ftrans_vals"])
+
+
+def _passive_open(ctx, path=None, resume_episode=False):
+    """
+    Move the ADP tables into memory-mapped files under `path` (default _CKPT_DIR), resuming from
+    the last checkpoint committed there. Counts gathered before the call are dropped, and so is the
+    agent table: every robot's next call starts a new transition chain and new metric sums.
+    resume_episode: continue the episode the checkpoint was taken in instead; robots found in it get
+    their rows back (last state and action, running sums), so only use it when the robots are
+    still where they were at that checkpoint.
+    """
+    cfg = ctx.cfg
+    S, A = cfg._S, cfg._A
+    ck = _Checkpoint(path or cfg._CKPT_DIR)
+    if ck.meta is not None and (ck.meta["bins_d"], ck.meta["bins_th"]) != (cfg.BIN_D, cfg.BIN_TH):
+        raise ValueError(f"{ck.root}: saved with {ck.meta['bins_d']}x{ck.meta['bins_th']} bins, "
+                         f"module uses {cfg.BIN_D}x{cfg.BIN_TH}")
+    if ck.meta is not None and ck.meta.get("n_actions", A) != A:
+        raise ValueError(f"{ck.root}: saved with {ck.meta['n_actions']} actions, module uses {A}")
+    if ck.meta is not None and (ck.meta.get("partition", "uniform"), ck.meta.get("part_levels", cfg._PART_LEVELS)) \
+            != (cfg._PARTITION, cfg._PART_LEVELS):
+        raise ValueError(f"{ck.root}: saved with the {ck.meta.get('partition', 'uniform')} partition, "
+                         f"module uses {cfg._PARTITION} ({cfg._PART_LEVELS} levels)")
+    ctx.vis = ck.live("vis", (S,), np.int32)
+    ctx.Rsum = ck.live("Rsum", (S,), np.float32)
+    ctx.V = ck.live("V", (S,), np.float32)
+    ctx.trans = ck.load_counts(_SparseCounts(S))
+    if cfg._ADP_MODE == "active" or ck.load("qvis") is not None:
+        # (state, action) tables: they stay empty in passive mode, so they only go to disk once
+        # active mode has used them (and then stay there, so later passive runs keep them)
+        ctx.qvis = ck.live("qvis", (S * A,), np.int32)
+        ctx.qRsum = ck.live("qRsum", (S * A,), np.float32)
+        ctx.pi = ck.live("pi", (S,), np.int64, fill=-1)
+        ctx.qtrans = ck.load_counts(_SparseCounts(S * A, ncols=S), "qtrans")
+    if cfg._PARTITION == "adaptive":
+        ctx.fvis = ck.live("fvis", (ctx.part.g ** 2,), np.int32)
+        ctx.fRsum = ck.live("fRsum", (ctx.part.g ** 2,), np.float32)
+        ctx.ftrans = ck.load_counts(_SparseCounts(ctx.part.g ** 2), "ftrans")
+        leaf_of = ck.load("part_leaf_of")
+        if leaf_of is not None:
+            ctx.part.restore(leaf_of, ck.load("part_box"))
+    if ck.meta is not None:
+        ctx.step, ctx.V_step = ck.meta["step"], ck.meta["V_step"]
+    ctx.AG.reset()
+    ids = ck.load("agent_id")
+    if resume_episode and ids is not None:
+        ctx.AG.restore(ids, {k: ck.load(f"agent_{k}") for k in cfg._AG_COLUMNS})
+    ctx.ckpt = ck
+
+
+def _checkpoint(ctx):
+    # commits only the count deltas since the previous checkpoint, plus the O(S) dense tables
+    # and the agent table (last state/action of every robot, running sums)
+    if ctx.ckpt is None:
+        return
+    cfg = ctx.cfg
+    dense = {"vis": ctx.vis, "Rsum": ctx.Rsum, "V": ctx.V}
+    dense.update((f"agent_{k}", col) for k, col in ctx.AG.columns().items())
+    counts = {"trans": ctx.trans}
+    if isinstance(ctx.qvis, np.memmap):     # opened on disk by _passive_open
+        dense.update(qvis=ctx.qvis, qRsum=ctx.qRsum, pi=ctx.pi)
+        counts["qtrans"] = ctx.qtrans
+    part = {"partition": cfg._PARTITION}
+    if cfg._PARTITION == "adaptive":
+        dense.update(fvis=ctx.fvis, fRsum=ctx.fRsum, part_leaf_of=ctx.part.leaf_of, part_box=ctx.part.box[:ctx.part.n])
+        counts["ftrans"] = ctx.ftrans
+        part["part_levels"] = cfg._PART_LEVELS
+    ctx.ckpt.commit(dense, counts, bins_d=cfg.BIN_D, bins_th=cfg.BIN_TH, n_actions=cfg._A, dmax=cfg.D_MAX,
+                    step=ctx.step, V_step=ctx.V_step, **part)
+
+
+def _robot_id(ego):
+    rid = getattr(ego, "id", None)
+    return rid if rid is not None else id(ego)
+
+
+def _wrap(a):  # wrap to [-pi,pi]
+    return (a + pi) % (2 * pi) - pi
+
+
+def _report(ctx, group=None, per_agent=False):
+    # metrics_p(): agent-level metrics over every robot of ctx, then the module's `group` entries
+    steps = max(int(ctx.AG["steps"].sum()),1)
+    report = {
+        # agent level
+        "mean_radial_error" : float(ctx.AG["sum_abs_er"].sum()) / steps,
+        "mean_angular_error" : float(ctx.AG["sum_abs_dth"].sum()) / steps,
+        "time_on_target_ratio": int(ctx.AG["on_target_steps"].sum()) / steps,
+    }
+    report.update(group or {})
+    print("[Metrics]", {k: (round(v, 4) if isinstance(v, float) else v) for k, v in report.items()})
+    if per_agent:
+        n = np.maximum(ctx.AG["steps"], 1)
+        report["per_agent"] = {
+            "id" : ctx.AG.ids(),
+            "steps" : ctx.AG["steps"].copy(),
+            "mean_radial_error" : ctx.AG["sum_abs_er"] / n,
+            "mean_angular_error" : ctx.AG["sum_abs_dth"] / n,
+            "time_on_target_ratio" : ctx.AG["on_target_steps"] / n,
+            "ema_dist" : ctx.AG["md"].copy(),
+        }
+    return report
+
+
+def _params(ego, **kwargs):
+    # per-robot parameters, parsed on first sight and again only when the yaml kwargs change:
+    # (raw kwargs, (cx, cy), radius, ((vmin_v, vmin_w), (vmax_v, vmax_w)) or None)
+    raw = (kwargs.get("center"), kwargs.get("radius"))
+    p = getattr(ego, "_rl_params", None)
+    if p is not None and p[0] == raw:
+        return p
+    #  default value: center[5.0, 5.0],radius 1.0, changed through yaml file
+    ego.circle_center = np.array([5.0, 5.0], dtype=np.float32)
+    ego.circle_radius = 1.0
+    if raw[0] is not None:
+        ego.circle_center = np.asarray(raw[0], dtype=np.float32).reshape(2)
+    if raw[1] is not None:
+        ego.circle_radius = float(raw[1])
+    bounds = None
+    if hasattr(ego, "vel_min") and hasattr(ego, "vel_max"):
+        vmin = np.asarray(ego.vel_min, np.float32).reshape(-1)
+        vmax = np.asarray(ego.vel_max, np.float32).reshape(-1)
+        bounds = ((float(vmin[0]), float(vmin[1])), (float(vmax[0]), float(vmax[1])))
+    center = (float(ego.circle_center[0]), float(ego.circle_center[1]))
+    ego._rl_params = p = (raw, center, ego.circle_radius, bounds)
+    return p
+
+
+def _state_features(ego,**kwargs):
+    s = np.asarray(ego.state, np.float32).reshape(-1)
+    x, y, th = float(s[0]), float(s[1]), float(s[2])
+    _, _C, _R, _ = _params(ego, **kwargs)
+    dx, dy = x - _C[0], y - _C[1]     # distance  to the center of the circle in x,y direction
+    phi_tan = atan2(dy, dx) + pi/2    # change to tangent direction
+    dth = _wrap(th - phi_tan)         # current direction- tangent direction
+    r=np.hypot(dx, dy)            # distance  to the center of the circle
+    e_r = r - _R  # difference between distance and R
+    dist = abs(e_r)
+    return dist, dth, e_r
+
+
+def _to_index(cfg, dist, dth):   # convert continuous variables into a single discrete state index
+    di = int(np.clip(dist / cfg.D_MAX * cfg.BIN_D, 0, cfg.BIN_D-1))  # convert to integers in [0,BIN_D-1]
+    ti = int(np.floor((dth + pi) / (2*pi) * cfg.BIN_TH))
+    ti = int(np.clip(ti, 0, cfg.BIN_TH-1))    # convert to integers in [0,BIN_TH-1]
+    return di * cfg.BIN_TH + ti
+
+
+def _adp_model_loop(trans, vis, Rsum, S_vis):
+    # the original per-element loop over a dense N(s,s'), kept as the A/B baseline of _adp_model_vectorized
+    N = trans.toarray()
+    P = np.zeros((S_vis.size, S_vis.size), dtype=np.float32)
+    R = np.zeros((S_vis.size,), dtype=np.float32)
+    idx_map = {s:i for i,s in enumerate(S_vis)}
+    # Naturalization: P , R
+    for si in S_vis:
+        i = idx_map[si]
+        row_sum = float(N[si].sum()) # sum of transitions from state si to all other states
+        if row_sum > 0:
+            for sj in S_vis:
+                j = idx_map[sj]
+                P[i, j] = N[si, sj] / row_sum # probability of state transitions approximated by previous counts
+        else:
+            P[i, i] = 1.0
+        R[i] = Rsum[si] / max(vis[si], 1)
+    return P, R
+
+
+def _adp_model_vectorized(trans, vis, Rsum, S_vis):
+    # Naturalization: P , R  in one pass over the visited block
+    row_sum = trans.row_sums()[S_vis]            # sum of transitions from every visited state
+    P = trans.block(S_vis)                       # dense copy of the visited block only
+    nz = row_sum > 0
+    P[nz] /= row_sum[nz, None]
+    dead = np.flatnonzero(~nz)
+    P[dead, dead] = 1.0                          # no outgoing counts: absorbing state
+    R = Rsum[S_vis] / np.maximum(vis[S_vis], 1)
+    return P, R.astype(np.float32, copy=False)
+
+
+def _adp_model_sparse(trans, vis, Rsum, S_vis):
+    # P and R of the visited states straight from the sparse counts, P as CSR-ordered (rows, cols, p)
+    # in positions of S_vis; no dense block. A state without outgoing counts has P[i, i] = 1
+    rows, cols = trans.rows_cols()                       # sorted by s, then s'
+    loc = np.full((max(trans.n, trans.m),), -1, dtype=np.int64)
+    loc[S_vis] = np.arange(S_vis.size)                   # S_vis is sorted, so rows stay sorted
+    keep = (loc[rows] >= 0) & (loc[cols] >= 0)
+    i, j = loc[rows[keep]], loc[cols[keep]]
+    row_sum = trans.row_sums()[S_vis].astype(np.float64)
+    p = trans.vals[keep] / row_sum[i]
+    dead = np.flatnonzero(row_sum == 0)
+    if dead.size:
+        order = np.argsort(np.concatenate((i, dead)), kind="stable")
+        i, j = np.concatenate((i, dead))[order], np.concatenate((j, dead))[order]
+        p = np.concatenate((p, np.ones(dead.size)))[order]
+    R = Rsum[S_vis] / np.maximum(vis[S_vis], 1)
+    return i, j, p, R.astype(np.float64)
+
+
+def _gauss_seidel(rows, cols, p, R, V, gamma, tol, max_iter):
+    # in-place sweeps on (I - γP)V = R over the CSR rows of P, starting from the previous estimate V;
+    # each row reads only its nonzero off-diagonal entries. Returns (V, sweeps, max|ΔV| of the last sweep)
+    n = V.size
+    own = rows == cols
+    diag = 1.0 - gamma * np.bincount(rows[own], weights=p[own], minlength=n)
+    rows, cols, coef = rows[~own], (cols[~own]).tolist(), (gamma * p[~own] / diag[rows[~own]]).tolist()
+    start = np.searchsorted(rows, np.arange(n + 1)).tolist()    # row i is start[i]:start[i+1]
+    # the sweeps are sequential by nature: plain Python lists beat per-row NumPy calls on rows this short
+    terms = [list(zip(cols[a:b], coef[a:b])) for a, b in zip(start[:-1], start[1:])]
+    b = (R / diag).tolist()
+    x = V.tolist()
+    sweeps, delta = 0, np.inf
+    while sweeps < max_iter and delta >= tol:
+        delta = 0.0
+        for i in range(n):
+            v_new = b[i] + sum([c * x[j] for j, c in terms[i]])
+            delta = max(delta, abs(v_new - x[i]))
+            x[i] = v_new
+        sweeps += 1
+    V[:] = x
+    return V, sweeps, delta
+
+
+def _adp_solve(cfg, trans, vis, Rsum, V):
+    #  (I - γP)V = R on the visited states; V is updated in place and returned
+    S_vis = np.where(vis > 0)[0]
+    if S_vis.size == 0:
+        return V
+    if cfg._ADP_SOLVER == "gauss_seidel":
+        rows, cols, p, R = _adp_model_sparse(trans, vis, Rsum, S_vis)
+        V_sub, sweeps, delta = _gauss_seidel(rows, cols, p, R, V[S_vis].astype(np.float64), cfg._GAMMA,
+                                             cfg._ADP_TOL, cfg._ADP_MAX_ITER)
+        if delta < cfg._ADP_TOL:
+            V[S_vis] = V_sub
+            return V
+        # not converged: a half-swept V is no estimate, solve directly instead
+        print(f"[ADP] gauss_seidel: no convergence after {sweeps} sweeps, max|dV|={delta:.2e}; solving directly")
+    if cfg._ADP_VECTORIZED:
+        P, R = _adp_model_vectorized(trans, vis, Rsum, S_vis)
+    else:
+        P, R = _adp_model_loop(trans, vis, Rsum, S_vis)
+    A = np.eye(S_vis.size, dtype=np.float32) - cfg._GAMMA * P
+    try:
+        V_sub = np.linalg.solve(A, R)
+    except np.linalg.LinAlgError:
+        V_sub = np.linalg.lstsq(A, R, rcond=None)[0]     #  solve the least squares problem
+    V[S_vis] = V_sub
+    return V
+
+
+def _part_refine(ctx):
+    # split busy leaves, then rebuild the leaf tables from the per-cell counts
+    if ctx.cfg._ADP_MODE == "active":   # (state, action) counts are per leaf only: keep the partition fixed
+        return
+    split = ctx.part.refine(ctx.fvis)
+    if not split:
+        return
+    ctx.solver.cancel()             # a solve still running was set up on the old leaves
+    S = ctx.vis.size
+    leaf = ctx.part.leaf_of
+    rows, cols = ctx.ftrans.rows_cols()
+    ctx.trans = _SparseCounts(S)
+    ctx.trans.add_many(leaf[rows], leaf[cols], ctx.ftrans.vals)
+    ctx.vis[:] = np.bincount(leaf, weights=ctx.fvis, minlength=S)
+    ctx.Rsum[:] = np.bincount(leaf, weights=ctx.fRsum, minlength=S)
+    for parent, child in split:     # warm start for the solve that follows
+        ctx.V[child] = ctx.V[parent]
+    seen = ctx.AG["last_cell"] >= 0
+    ctx.AG["last_state"][seen] = leaf[ctx.AG["last_cell"][seen]]
+
+
+def _adp_iterate(cfg, qtrans, qvis, qRsum, pi, V):
+    # one policy-iteration step: evaluate pi with the passive solve, then improve it greedily
+    trans, vis, Rsum = _policy_tables(qtrans, qvis, qRsum, pi, cfg._A)
+    _adp_solve(cfg, trans, vis, Rsum, V)
+    return V, _greedy_policy(qtrans, qvis, qRsum, V, cfg._GAMMA, pi)
+
+
+def _adp_policy_evaluation(ctx):
+    cfg = ctx.cfg
+    if not cfg._ADP_ASYNC:
+        if cfg._ADP_MODE == "active":
+            _, ctx.pi[:] = _adp_iterate(cfg, ctx.qtrans, ctx.qvis, ctx.qRsum, ctx.pi, ctx.V)
+        else:
+            _adp_solve(cfg, ctx.trans, ctx.vis, ctx.Rsum, ctx.V)
+        ctx.V_step = ctx.step
+        return
+    # solve on a snapshot off the control loop (LAPACK releases the GIL); _adp_collect swaps it in
+    if cfg._ADP_MODE == "active":
+        ctx.solver.submit(_adp_iterate, (cfg, ctx.qtrans.copy(), ctx.qvis.copy(), ctx.qRsum.copy(), ctx.pi.copy(),
+                                         ctx.V.copy()), ctx.step)
+    else:
+        ctx.solver.submit(_adp_solve, (cfg, ctx.trans.copy(), ctx.vis.copy(), ctx.Rsum.copy(), ctx.V.copy()), ctx.step)
+
+
+def _adp_collect(ctx):
+    # install a finished background solve with one copy on the control thread
+    done = ctx.solver.poll()
+    if done is not None:
+        ctx.V_step, V_new = done
+        if isinstance(V_new, tuple):    # active mode: (V, pi)
+            V_new, pi_new = V_new
+            ctx.pi[:] = pi_new
+        ctx.V[:] = V_new
+
+
+def _nearest_action(cfg, v, w):
+    # primitive closest to a (v, w) command
+    return int(np.argmin((cfg._ACTIONS[:, 0] - v) ** 2 + (cfg._ACTIONS[:, 1] - w) ** 2))
+
+
+def _choose_action(ctx, state, dth, e_r):
+    # ε-greedy on ctx.pi; states not improved yet follow the fixed policy snapped to a primitive
+    cfg = ctx.cfg
+    a = int(ctx.pi[state])
+    if a < 0:
+        a = _nearest_action(cfg, cfg._V0, - cfg._KW * dth + cfg._KR * e_r)
+    if np.random.random() < cfg._ADP_EPS:
+        a = np.random.randint(cfg._A)
+    return a
+
+
+def _adp_advance(ctx, n=1):
+    # count n RL_passive calls; evaluate whenever the fleet total crosses a multiple of _ADP_EVERY
+    cfg = ctx.cfg
+    before = ctx.step
+    ctx.step += n
+    if cfg._ADP_ASYNC:
+        _adp_collect(ctx)
+    if ctx.ckpt is not None and ctx.step // cfg._CKPT_EVERY > before // cfg._CKPT_EVERY:
+        _checkpoint(ctx)
+    if ctx.step // cfg._ADP_EVERY > before // cfg._ADP_EVERY:
+        if cfg._PARTITION == "adaptive":
+            _part_refine(ctx)
+        if cfg._ADP_ESTIMATOR == "lstd":
+            ctx.V_step = ctx.step
+        else:
+            _adp_policy_evaluation(ctx)
+        # print process
+        print(f"[ADP] visited={int((ctx.vis>0).sum())}/{ctx.vis.size}, "
+              f"avgV={ctx.V[ctx.vis>0].mean():.3f}, "
+              f"mean|dist|={ctx.AG['md'].mean():.3f},steps={ctx.step}, "
+              f"V_age={ctx.step - ctx.V_step}"
+              + (f", dropped_solves={ctx.solver.dropped}" if cfg._ADP_ASYNC else ""))
+
+
+def _shape_like_ref(u, ref_like):
+    arr = np.asarray(u, np.float32).reshape(-1)
+    ref = np.asarray(ref_like) if ref_like is not None else None
+    return arr.reshape(-1,1) if (ref is not None and ref.ndim==2) else arr
+
+
+def _rl_passive(ctx, ego_object, **kwargs):
+    # RL_passive for one robot: count its transition, advance the evaluation cadence, return its [v, w]
+    cfg = ctx.cfg
+    if cfg._CKPT_DIR is not None and ctx.ckpt is None:
+        _passive_open(ctx)
+    row = ctx.AG.row(_robot_id(ego_object))
+
+    # current state
+    dist, dth, e_r = _state_features(ego_object,**kwargs)
+    if cfg._PARTITION == "adaptive":
+        cell_now = ctx.part.cell(dist, dth)
+        state_now = int(ctx.part.leaf_of[cell_now])
+    else:
+        state_now = _to_index(cfg, dist, dth)
+
+    # reward
+    r_now = -min(dist, cfg.D_MAX)   # the closer to the circle,the higher reward
+    if getattr(ego_object, "collision", False):
+        r_now -= 10.0
+
+    # count（previous -> current state）
+    last_state = int(ctx.AG["last_state"][row])   # this robot's previous state
+    if last_state >= 0:
+        ctx.trans.add(last_state, state_now)
+        ctx.vis[last_state] += 1
+        ctx.Rsum[last_state] += r_now  # sum of rewards attributed to last_state
+    if cfg._PARTITION == "adaptive":
+        last_cell = int(ctx.AG["last_cell"][row])
+        if last_cell >= 0:
+            ctx.ftrans.add(last_cell, cell_now)
+            ctx.fvis[last_cell] += 1
+            ctx.fRsum[last_cell] += r_now
+        ctx.AG["last_cell"][row] = cell_now
+    last_action = int(ctx.AG["last_action"][row])
+    if last_state >= 0 and last_action >= 0:   # same counts per (state, action) for active mode
+        sa = last_state * cfg._A + last_action
+        ctx.qtrans.add(sa, state_now)
+        ctx.qvis[sa] += 1
+        ctx.qRsum[sa] += r_now
+    if cfg._ADP_ESTIMATOR == "lstd":
+        if last_state >= 0:
+            ctx.lstd.update((ctx.AG["last_dist"][row], ctx.AG["last_dth"][row], ctx.AG["last_er"][row]), r_now, (dist, dth, e_r))
+        ctx.V[state_now] = ctx.lstd.value((dist, dth, e_r))
+
+    # Every "_ADP_EVERY" times give an evaluation
+    _adp_advance(ctx)
+
+    if cfg._ADP_MODE == "active":
+        a = _choose_action(ctx, state_now, dth, e_r)
+        v, w = float(cfg._ACTIONS[a, 0]), float(cfg._ACTIONS[a, 1])
+        ctx.AG["last_action"][row] = a
+    else:
+        # constant policy
+        v = cfg._V0     # constant linear velocity
+        w = - cfg._KW * dth+ cfg._KR * e_r  # angular velocity controlled by _KW and _KR * e_r
+        ctx.AG["last_action"][row] = -1
+
+    # velocity constrained to vel_min/vel_max
+    bounds = ego_object._rl_params[3]
+    if bounds is not None:
+        (vmin_v, vmin_w), (vmax_v, vmax_w) = bounds
+        v = min(max(v, vmin_v), vmax_v)
+        w = min(max(w, vmin_w), vmax_w)
+
+    ctx.AG["last_state"][row] = state_now
+    ctx.AG["last_dist"][row], ctx.AG["last_dth"][row], ctx.AG["last_er"][row] = dist, dth, e_r
+    ctx.AG["steps"][row] += 1
+    ctx.AG["md"][row] = 0.99 * ctx.AG["md"][row] + 0.01 * dist    # exponential moving average
+    ctx.AG["sum_abs_er"][row] += abs(e_r)
+    ctx.AG["sum_abs_dth"][row] += abs(dth)
+    if dist < cfg._Thres:
+        ctx.AG["on_target_steps"][row] += 1
+    return _shape_like_ref([v, w], getattr(ego_object, "vel_min", None))
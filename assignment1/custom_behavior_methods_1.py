@@ -1,7 +1,11 @@
 
 import numpy as np
-from math import atan2, pi
+import sys
+import weakref
+from math import pi
 from irsim.lib import register_behavior
+from adp_tables import _ADPContext, _Contexts, _passive_save, _passive_load, _passive_open, _checkpoint, \
+    _robot_id, _wrap, _report, _params, _adp_advance, _rl_passive, _shape_like_ref
 
 
 _GAMMA = 0.99     # used in (I - γP)V = R
@@ -16,158 +20,220 @@ _KR = 0.6
 BIN_D, BIN_TH = 10, 12    # Number of distance bins and angle bins
 D_MAX = 3.0               # Maximum considered distance
 
-# ADP statistics
 _S = BIN_D * BIN_TH
-_trans = np.zeros((_S, _S), dtype=np.float32)   # N(s,s')
-_vis   = np.zeros((_S,), dtype=np.int32)        # N(s)
-_Rsum  = np.zeros((_S,), dtype=np.float32)      # ∑r(s)
-_V     = np.zeros((_S,), dtype=np.float32)      # estimated V(s)
-_last_state = None
 
 # quality metrics parameters
 _Thres = 0.8
-_M = {
-    "steps" : 0,
-    "sum_abs_er" : 0.0,
-    "sum_abs_dth" : 0.0,
-    "on_target_steps" : 0,
+# per-agent state and metric accumulators, one row per robot id
+_AG_COLUMNS = {
+    "last_state" : (np.int64, -1),          # previous state index, -1 before the first call
+    "steps" : (np.int64, 0),
+    "md" : (np.float64, 0.0),               # EMA of |dist|
+    "sum_abs_er" : (np.float64, 0.0),
+    "sum_abs_dth" : (np.float64, 0.0),
+    "on_target_steps" : (np.int64, 0),
+    "last_action" : (np.int64, -1),         # previous _ACTIONS index in active mode, -1 otherwise
+    "last_dist" : (np.float64, np.nan),     # previous (dist, dth, e_r), for the LSTD estimator
+    "last_dth" : (np.float64, np.nan),
+    "last_er" : (np.float64, np.nan),
+    "last_cell" : (np.int64, -1),           # previous fine cell of ctx.part, adaptive partition only
 }
 
 _ADP_EVERY = 200
-_step = 0
-
-def passive_save(path="circle follow.npz"):
-    np.savez(path, V=_V, trans=_trans, vis=_vis, Rsum=_Rsum,
-             bins_d=BIN_D, bins_th=BIN_TH, dmax=D_MAX)
+_ADP_VECTORIZED = True    # False: original per-element loop, kept for A/B timing
+_ADP_SOLVER = "direct"    # "direct": np.linalg.solve ; "gauss_seidel": sweeps warm-started from ctx.V
+_ADP_TOL = 1e-4           # stop sweeping once max|ΔV| is below this
+_ADP_MAX_ITER = 50        # sweep cap per evaluation; past it the evaluation falls back to the direct solve
+_ADP_ASYNC = False        # True: solve a snapshot of the counts in a worker thread
+# "table": periodic (I - γP)V = R solves ; "lstd": LSTD on features of (dist, dth, e_r), updated every step
+# (passive mode only, refused in active mode; ctx.V[s] then holds the estimate at the last visit of s)
+_ADP_ESTIMATOR = "table"
+
+# "uniform": BIN_D x BIN_TH bins ; "adaptive": leaves of a k-d split of a 32 x 32 (dist, dth) grid, at most _S,
+# refined where visits pile up before each evaluation. The leaf tables stay _S long, but the counts per fine cell
+# (32 x 32 N(c) and ∑r(c), sparse N(c,c')) are kept on top of them so the leaf tables can be rebuilt after a split
+_PARTITION = "uniform"
+_PART_LEVELS = 5
+_PART_SPLIT = 200
+
+# active ADP: policy iteration over (v, w) primitives; "passive" runs the fixed _V0/_KW/_KR policy
+_ADP_MODE = "passive"
+_ACTIONS = np.array([(v, w) for v in (0.2, 0.4, 0.6, 0.8) for w in np.linspace(-1.5, 1.5, 7)], dtype=np.float32)
+_A = len(_ACTIONS)
+_ADP_EPS = 0.1            # ε-greedy exploration in active mode
+
+# checkpointing: with _CKPT_DIR set, the tables live in np.memmap files there and are committed every _CKPT_EVERY steps
+_CKPT_DIR = None
+_CKPT_EVERY = 1000
+
+# fleet batching: the first robot to act in a tick computes (v, w) for every robot still waiting
+_BATCH = True
+
+
+# ==== per-environment state ====
+class _Context(_ADPContext):
+    """Everything rl_passive_1 learns or tracks for one irsim environment."""
+
+    def __init__(self):
+        super().__init__(sys.modules[__name__])     # ADP tables sized and configured by the globals above
+        # fleet batching
+        self.peers = weakref.WeakValueDictionary()   # id(ego) -> every robot running rl_passive_1
+        self.tick = {"served": set(), "vw": {}}       # robots that already acted this tick / rows waiting to be read
+
+_CTX = _Contexts(_Context)           # irsim environment -> _Context, dropped with the environment
+
+def passive_save(path="circle follow.npz", env=None):
+    # env: the irsim environment whose tables are saved, default the one that ran last
+    _passive_save(_CTX.of(env), path)
+
+def passive_load(path="circle follow.npz", env=None):
+    _passive_load(_CTX.of(env), path)
+
+def passive_open(path=None, env=None, resume_episode=False):
+    """
+    Move the ADP tables into memory-mapped files under `path` (default _CKPT_DIR), resuming from
+    the learned tables of the last checkpoint committed there. resume_episode=True also restores
+    each robot's last state and metric sums, to continue the episode the checkpoint was taken in.
+    """
+    _passive_open(_CTX.of(env), path, resume_episode)
+
+def passive_checkpoint(env=None):
+    _checkpoint(_CTX.of(env))
 
 # ==== tools ====
-def _wrap(a):  # wrap to [-pi,pi]
-    return (a + pi) % (2 * pi) - pi
-
-def metrics_p():
-    steps = max(_M["steps"],1)
-    report = {
-        # agent level
-        "mean_radial_error" : _M["sum_abs_er"] / steps,
-        "mean_angular_error" : _M["sum_abs_dth"] / steps,
-        "time_on_target_ratio": _M["on_target_steps"] / steps,
-
-    }
-    print("[Metrics]", {k: (round(v, 4) if isinstance(v, float) else v) for k, v in report.items()})
-    return report
-
-def _ensure_circle_params(ego,**kwargs):
-    #  default value: center[5.0, 5.0],radius 1.0, changed through yaml file
-    ego.circle_center = np.array([5.0, 5.0], dtype=np.float32)
-    ego.circle_radius = 1.0
-    if "center" in kwargs:
-        ego.circle_center = np.asarray(kwargs["center"], dtype=np.float32).reshape(2)
-    if "radius" in kwargs:
-        ego.circle_radius = float(kwargs["radius"])
-    return ego.circle_center, ego.circle_radius
-
-
-def _state_features(ego,**kwargs):
-    s = np.asarray(ego.state, np.float32).reshape(-1)
-    x, y, th = float(s[0]), float(s[1]), float(s[2])
-    _C, _R = _ensure_circle_params(ego, **kwargs)
-    dx, dy = x - _C[0], y - _C[1]     # distance  to the center of the circle in x,y direction
-    phi_tan = atan2(dy, dx) + pi/2    # change to tangent direction
-    dth = _wrap(th - phi_tan)         # current direction- tangent direction
-    r=np.hypot(dx, dy)            # distance  to the center of the circle
-    e_r = r - _R  # difference between distance and R
-    dist = abs(e_r)
-    return dist, dth, e_r
-
-def _to_index(dist, dth):   # convert continuous variables into a single discrete state index
-    di = int(np.clip(dist / D_MAX * BIN_D, 0, BIN_D-1))  # convert to integers in [0,BIN_D-1]
-    ti = int(np.floor((dth + pi) / (2*pi) * BIN_TH))
-    ti = int(np.clip(ti, 0, BIN_TH-1))    # convert to integers in [0,BIN_TH-1]
+def _register_peer(ctx, ego):
+    if id(ego) not in ctx.peers:
+        ctx.peers[id(ego)] = ego
+
+def metrics_p(per_agent=False, env=None):
+    # env: the irsim environment to report on, default the one that ran last
+    return _report(_CTX.of(env), per_agent=per_agent)
+
+def _to_index_batch(dist, dth):   # _to_index over arrays
+    di = np.clip(dist / D_MAX * BIN_D, 0, BIN_D-1).astype(np.int64)
+    ti = np.clip(np.floor((dth + pi) / (2*pi) * BIN_TH), 0, BIN_TH-1).astype(np.int64)
     return di * BIN_TH + ti
 
-def _adp_policy_evaluation():
-    #  (I - γP)V = R
-    S_vis = np.where(_vis > 0)[0]
-    if S_vis.size == 0:
-        return
-    P = np.zeros((S_vis.size, S_vis.size), dtype=np.float32)
-    R = np.zeros((S_vis.size,), dtype=np.float32)
-    idx_map = {s:i for i,s in enumerate(S_vis)}
-    # Naturalization: P , R
-    for si in S_vis:
-        i = idx_map[si]
-        row_sum = float(_trans[si].sum()) # sum of transitions from state si to all other states
-        if row_sum > 0:
-            for sj in S_vis:
-                j = idx_map[sj]
-                P[i, j] = _trans[si, sj] / row_sum # probability of state transitions approximated by previous counts
-        else:
-            P[i, i] = 1.0
-        R[i] = _Rsum[si] / max(_vis[si], 1)
-    A = np.eye(S_vis.size, dtype=np.float32) - _GAMMA * P
-    try:
-        V_sub = np.linalg.solve(A, R)
-    except np.linalg.LinAlgError:
-        V_sub = np.linalg.lstsq(A, R, rcond=None)[0]     #  solve the least squares problem
-    _V[S_vis] = V_sub
-
-def _shape_like_ref(u, ref_like):
-    arr = np.asarray(u, np.float32).reshape(-1)
-    ref = np.asarray(ref_like) if ref_like is not None else None
-    return arr.reshape(-1,1) if (ref is not None and ref.ndim==2) else arr
+def _choose_action_batch(ctx, state, dth, e_r):
+    # _choose_action over arrays
+    a = ctx.pi[state].copy()
+    fixed = a < 0
+    if fixed.any():
+        w = - _KW * dth[fixed] + _KR * e_r[fixed]
+        a[fixed] = np.argmin((_ACTIONS[None, :, 0] - _V0) ** 2 + (_ACTIONS[None, :, 1] - w[:, None]) ** 2, axis=1)
+    explore = np.random.random(a.size) < _ADP_EPS
+    a[explore] = np.random.randint(_A, size=int(explore.sum()))
+    return a
 
 def RL_passive(ego_object, objects=None, *args, **kwargs):
-
-    global _last_state, _step
+    return _rl_passive(_CTX.of_ego(ego_object), ego_object, **kwargs)
+
+def RL_passive_batch(poses, centers, radii, rows, vmin=None, vmax=None, collision=None, env=None):
+    """
+    RL_passive for N robots in one pass.
+    poses (N,3), centers (N,2), radii (N,), rows (N,) = agent table rows, vmin/vmax (N,2), collision (N,).
+    env: the irsim environment whose tables are updated, default the one that ran last.
+    Returns (N,2) float32 [v, w].
+    """
+    ctx = _CTX.of(env)
+    if _CKPT_DIR is not None and ctx.ckpt is None:
+        passive_open(env=env)
+    poses = np.asarray(poses, np.float64).reshape(-1, 3)
+    centers = np.asarray(centers, np.float64).reshape(-1, 2)
+    rows = np.asarray(rows, np.int64)
 
     # current state
-    dist, dth, e_r = _state_features(ego_object,**kwargs)
-    state_now = _to_index(dist, dth)
+    dx, dy = poses[:, 0] - centers[:, 0], poses[:, 1] - centers[:, 1]
+    dth = _wrap(poses[:, 2] - (np.arctan2(dy, dx) + pi/2))
+    e_r = np.hypot(dx, dy) - np.asarray(radii, np.float64)
+    dist = np.abs(e_r)
+    if _PARTITION == "adaptive":
+        cell_now = ctx.part.cells(dist, dth)
+        state_now = ctx.part.leaf_of[cell_now]
+    else:
+        state_now = _to_index_batch(dist, dth)
 
     # reward
-    r_now = -min(dist, D_MAX)   # the closer to the circle,the higher reward
-    if getattr(ego_object, "collision", False):
-        r_now -= 10.0
-
+    r_now = -np.minimum(dist, D_MAX)
+    if collision is not None:
+        r_now = r_now - 10.0 * np.asarray(collision, bool)
 
     # count（previous -> current state）
-    if _last_state is not None:
-        _trans[_last_state, state_now] += 1.0
-        _vis[_last_state] += 1
-        _Rsum[_last_state] += r_now  # sum of rewards attributed to _last_state
-
-    _step += 1
-
-    # Every "_ADP_EVERY" times give an evaluation
-    if _step % _ADP_EVERY == 0:
-        _adp_policy_evaluation()
-        # print process
-        print(f"[ADP] visited={int((_vis>0).sum())}/{_S}, "
-              f"avgV={_V[_vis>0].mean():.3f}, "
-              f"mean|dist|={getattr(RL_passive,'_stat',{}).get('md',0):.3f},steps={_step}")
-
-    # constant policy
-    v = _V0     # constant linear velocity
-    w = - _KW * dth+ _KR * e_r  # angular velocity controlled by _KW and _KR * e_r
-
-    # velocity constrained to vel_min/vel_max
-    if hasattr(ego_object, "vel_min") and hasattr(ego_object, "vel_max"):
-        vmin = np.asarray(ego_object.vel_min, np.float32).reshape(-1)
-        vmax = np.asarray(ego_object.vel_max, np.float32).reshape(-1)
-        v = float(np.clip(v, vmin[0], vmax[0]))
-        w = float(np.clip(w, vmin[1], vmax[1]))
-
-    _last_state = state_now
-    _glob = getattr(RL_passive, "_stat", {"n": 0, "md": 0.0})
-    _glob["n"] += 1
-    _glob["md"] = 0.99 * _glob["md"] + 0.01 * dist    # exponential moving average
-    setattr(RL_passive, "_stat", _glob)
-    _M["steps"] += 1
-    _M["sum_abs_er"] += abs(e_r)
-    _M["sum_abs_dth"] += abs(dth)
-    if dist < _Thres:
-        _M["on_target_steps"] += 1
-    return _shape_like_ref([v, w], getattr(ego_object, "vel_min", None))
+    last_state = ctx.AG["last_state"][rows]
+    m = last_state >= 0
+    ctx.trans.add_many(last_state[m], state_now[m])
+    np.add.at(ctx.vis, last_state[m], 1)
+    np.add.at(ctx.Rsum, last_state[m], r_now[m])
+    if _PARTITION == "adaptive":
+        last_cell = ctx.AG["last_cell"][rows]
+        mc = last_cell >= 0
+        ctx.ftrans.add_many(last_cell[mc], cell_now[mc])
+        np.add.at(ctx.fvis, last_cell[mc], 1)
+        np.add.at(ctx.fRsum, last_cell[mc], r_now[mc])
+        ctx.AG["last_cell"][rows] = cell_now
+    last_action = ctx.AG["last_action"][rows]
+    q = m & (last_action >= 0)
+    sa = last_state[q] * _A + last_action[q]
+    ctx.qtrans.add_many(sa, state_now[q])
+    np.add.at(ctx.qvis, sa, 1)
+    np.add.at(ctx.qRsum, sa, r_now[q])
+    X_now = np.stack((dist, dth, e_r), axis=1)
+    if _ADP_ESTIMATOR == "lstd":
+        X_last = np.stack((ctx.AG["last_dist"][rows], ctx.AG["last_dth"][rows], ctx.AG["last_er"][rows]), axis=1)
+        ctx.lstd.update_many(X_last[m], r_now[m], X_now[m])
+        ctx.V[state_now] = ctx.lstd.value(X_now)
+
+    _adp_advance(ctx, rows.size)
+
+    vw = np.empty((rows.size, 2), dtype=np.float32)
+    if _ADP_MODE == "active":
+        a = _choose_action_batch(ctx, state_now, dth, e_r)
+        vw[:] = _ACTIONS[a]
+        ctx.AG["last_action"][rows] = a
+    else:
+        # constant policy
+        vw[:, 0] = _V0
+        vw[:, 1] = - _KW * dth + _KR * e_r
+        ctx.AG["last_action"][rows] = -1
+    if vmin is not None and vmax is not None:
+        np.clip(vw, np.asarray(vmin, np.float32), np.asarray(vmax, np.float32), out=vw)
+
+    ctx.AG["last_state"][rows] = state_now
+    ctx.AG["last_dist"][rows], ctx.AG["last_dth"][rows], ctx.AG["last_er"][rows] = X_now.T
+    ctx.AG["steps"][rows] += 1
+    ctx.AG["md"][rows] = 0.99 * ctx.AG["md"][rows] + 0.01 * dist    # exponential moving average
+    ctx.AG["sum_abs_er"][rows] += dist
+    ctx.AG["sum_abs_dth"][rows] += np.abs(dth)
+    ctx.AG["on_target_steps"][rows] += dist < _Thres
+    return vw
+
+def _acts_this_tick(ego):
+    # irsim skips the behavior of static robots and of robots its collision mode has stopped;
+    # the flags are only updated after every object has stepped, so they hold for the whole tick
+    return not (getattr(ego, "static", False) or getattr(ego, "stop_flag", False))
+
+def _fleet_batch_step(ctx, egos=None):
+    # gather every registered robot that will still act this tick and run them as one batch
+    if egos is None:
+        egos = [e for k, e in list(ctx.peers.items()) if k not in ctx.tick["served"] and _acts_this_tick(e)]
+    n = len(egos)
+    poses = np.empty((n, 3), dtype=np.float64)
+    centers = np.empty((n, 2), dtype=np.float64)
+    radii = np.empty((n,), dtype=np.float64)
+    vmin = np.full((n, 2), -np.inf, dtype=np.float32)
+    vmax = np.full((n, 2), np.inf, dtype=np.float32)
+    collision = np.zeros((n,), dtype=bool)
+    rows = np.empty((n,), dtype=np.int64)
+    for k, e in enumerate(egos):
+        _, centers[k], radii[k], bounds = e._rl_params
+        poses[k] = np.asarray(e.state, np.float32).reshape(-1)[:3]
+        if bounds is not None:
+            vmin[k], vmax[k] = bounds
+        collision[k] = bool(getattr(e, "collision", False))
+        rows[k] = ctx.AG.row(_robot_id(e))
+    vw = RL_passive_batch(poses, centers, radii, rows, vmin, vmax, collision, env=getattr(egos[0], "_env", None))
+    for e, u in zip(egos, vw):
+        ctx.tick["vw"][id(e)] = u
 
 
 
@@ -175,8 +241,22 @@ def RL_passive(ego_object, objects=None, *args, **kwargs):
 # ==== register behavior：（policy fixed，estimate V only） ====
 @register_behavior("diff", "rl_passive_1")
 def subsumption_nav(ego_object, objects=None, *args, **kwargs):
-    v, w = RL_passive(ego_object, objects, *args, **kwargs)   #  RL_passive
-    return np.array([v, w], dtype=np.float32)
+    if not _BATCH:
+        v, w = RL_passive(ego_object, objects, *args, **kwargs)   #  RL_passive
+        return np.array([v, w], dtype=np.float32)
+
+    _params(ego_object, **kwargs)
+    ctx = _CTX.of_ego(ego_object)
+    k = id(ego_object)
+    first_call = k not in ctx.peers
+    _register_peer(ctx, ego_object)
+    if k in ctx.tick["served"]:          # this robot already acted: a new tick has started
+        ctx.tick["served"].clear()
+        ctx.tick["vw"].clear()
+    if k not in ctx.tick["vw"]:
+        _fleet_batch_step(ctx, [ego_object] if first_call else None)
+    ctx.tick["served"].add(k)
+    return _shape_like_ref(ctx.tick["vw"].pop(k), getattr(ego_object, "vel_min", None))
 
 
 
@@ -1,10 +1,11 @@
-
 import numpy as np
-from math import atan2, pi
+import sys
+from math import pi
 from irsim.lib import register_behavior
+from adp_tables import _ADPContext, _Contexts, _passive_save, _passive_load, _passive_open, _checkpoint, \
+    _robot_id, _report, _rl_passive, _shape_like_ref, _SpatialHash
 import weakref
 
-_PEERS = []
 _GAMMA = 0.99     # used in (I - γP)V = R
 
 # policy π parameters
@@ -18,209 +19,171 @@ _AVOID_SPEED   = 0.1
 _AVOID_TURN    = 1.5
 
 
-
 BIN_D, BIN_TH = 10, 12    # Number of distance bins and angle bins
 D_MAX = 3.0               # Maximum considered distance
 
-# ADP statistics
 _S = BIN_D * BIN_TH
-_trans = np.zeros((_S, _S), dtype=np.float32)   # N(s,s')
-_vis   = np.zeros((_S,), dtype=np.int32)        # N(s)
-_Rsum  = np.zeros((_S,), dtype=np.float32)      # ∑r(s)
-_V     = np.zeros((_S,), dtype=np.float32)      # estimated V(s)
-_last_state = None
 
 # quality metrics parameters
 _Thres = 0.8
-_M = {
-    "steps" : 0,
-    "sum_abs_er" : 0.0,
-    "sum_abs_dth" : 0.0,
-    "on_target_steps" : 0,
-    "avoid_steps" : 0,
-    "sep_min" : float("inf"),
-    "sep_sum" : 0.0,
-    "sep_count":0,
+# per-agent state and metric accumulators, one row per robot id
+_AG_COLUMNS = {
+    "last_state" : (np.int64, -1),          # previous state index, -1 before the first call
+    "steps" : (np.int64, 0),
+    "md" : (np.float64, 0.0),               # EMA of |dist|
+    "sum_abs_er" : (np.float64, 0.0),
+    "sum_abs_dth" : (np.float64, 0.0),
+    "on_target_steps" : (np.int64, 0),
+    "last_action" : (np.int64, -1),         # previous _ACTIONS index in active mode, -1 otherwise
+    "last_dist" : (np.float64, np.nan),     # previous (dist, dth, e_r), for the LSTD estimator
+    "last_dth" : (np.float64, np.nan),
+    "last_er" : (np.float64, np.nan),
+    "last_cell" : (np.int64, -1),           # previous fine cell of ctx.part, adaptive partition only
+    "avoid_steps" : (np.int64, 0),
+    "sep_min" : (np.float64, np.inf),
+    "sep_sum" : (np.float64, 0.0),
+    "sep_count" : (np.int64, 0),
 }
 
 
 _ADP_EVERY = 200
-_step = 0
-
-def passive_save(path="circle follow.npz"):
-    np.savez(path, V=_V, trans=_trans, vis=_vis, Rsum=_Rsum,
-             bins_d=BIN_D, bins_th=BIN_TH, dmax=D_MAX)
+_ADP_VECTORIZED = True    # False: original per-element loop, kept for A/B timing
+_ADP_SOLVER = "direct"    # "direct": np.linalg.solve ; "gauss_seidel": sweeps warm-started from ctx.V
+_ADP_TOL = 1e-4           # stop sweeping once max|ΔV| is below this
+_ADP_MAX_ITER = 50        # sweep cap per evaluation; past it the evaluation falls back to the direct solve
+_ADP_ASYNC = False        # True: solve a snapshot of the counts in a worker thread
+# "table": periodic (I - γP)V = R solves ; "lstd": LSTD on features of (dist, dth, e_r), updated every step
+# (passive mode only, refused in active mode; ctx.V[s] then holds the estimate at the last visit of s)
+_ADP_ESTIMATOR = "table"
+
+# "uniform": BIN_D x BIN_TH bins ; "adaptive": leaves of a k-d split of a 32 x 32 (dist, dth) grid, at most _S,
+# refined where visits pile up before each evaluation. The leaf tables stay _S long, but the counts per fine cell
+# (32 x 32 N(c) and ∑r(c), sparse N(c,c')) are kept on top of them so the leaf tables can be rebuilt after a split
+_PARTITION = "uniform"
+_PART_LEVELS = 5
+_PART_SPLIT = 200
+
+# active ADP: policy iteration over (v, w) primitives; "passive" runs the fixed _V0/_KW/_KR policy
+_ADP_MODE = "passive"
+_ACTIONS = np.array([(v, w) for v in (0.2, 0.4, 0.6, 0.8) for w in np.linspace(-1.5, 1.5, 7)], dtype=np.float32)
+_A = len(_ACTIONS)
+_ADP_EPS = 0.1            # ε-greedy exploration in active mode
+
+# checkpointing: with _CKPT_DIR set, the tables live in np.memmap files there and are committed every _CKPT_EVERY steps
+_CKPT_DIR = None
+_CKPT_EVERY = 1000
+
+
+# ==== per-environment state ====
+class _Context(_ADPContext):
+    """Everything rl_passive_2 learns or tracks for one irsim environment."""
+
+    def __init__(self):
+        super().__init__(sys.modules[__name__])     # ADP tables sized and configured by the globals above
+        # peer positions, rebuilt when a new tick starts and kept current as robots act one after another
+        self.peers = weakref.WeakValueDictionary()   # id(ego) -> ego
+        self.grid = _SpatialHash(_OBS_THRESHOLD)
+        self.tick = {"served": set(), "last": None, "prev": None, "n": 0}
+        self.obj = {"tick": -1, "rows": {}, "xy": np.zeros((0, 2))}   # object positions for _check_obstacle
+
+_CTX = _Contexts(_Context)           # irsim environment -> _Context, dropped with the environment
+
+def passive_save(path="circle follow.npz", env=None):
+    # env: the irsim environment whose tables are saved, default the one that ran last
+    _passive_save(_CTX.of(env), path)
+
+def passive_load(path="circle follow.npz", env=None):
+    _passive_load(_CTX.of(env), path)
+
+def passive_open(path=None, env=None, resume_episode=False):
+    """
+    Move the ADP tables into memory-mapped files under `path` (default _CKPT_DIR), resuming from
+    the learned tables of the last checkpoint committed there. resume_episode=True also restores
+    each robot's last state and metric sums, to continue the episode the checkpoint was taken in.
+    """
+    _passive_open(_CTX.of(env), path, resume_episode)
+
+def passive_checkpoint(env=None):
+    _checkpoint(_CTX.of(env))
 
 # ==== tools ====
-def _register_peer(ego):
-    for w in _PEERS:
-        if w() is ego:
-            return
-    _PEERS.append(weakref.ref(ego))
-
-def _nearest_sep_from_peers(ego):
+def _register_peer(ctx, ego):
+    ctx.peers.setdefault(id(ego), ego)
+
+def _peer_xy(ego):
+    return float(ego.state[0]), float(ego.state[1])
+
+def _grid_sync(ctx, ego):
+    k = id(ego)
+    if k in ctx.tick["served"]:            # this robot already acted: a new tick has started
+        ctx.tick["served"].clear()
+        ctx.tick["n"] += 1
+        ctx.tick["prev"] = None
+        ctx.grid.rebuild((i, *_peer_xy(e)) for i, e in list(ctx.peers.items()) if hasattr(e, "state"))
+    else:
+        prev = ctx.tick["last"] and ctx.tick["last"]()
+        if prev is not None and hasattr(prev, "state"):   # the previous caller has moved since
+            ctx.grid.move(id(prev), *_peer_xy(prev))
+        ctx.tick["prev"] = prev
+        if k not in ctx.grid.slot and hasattr(ego, "state"):
+            ctx.grid.move(k, *_peer_xy(ego))
+    ctx.tick["served"].add(k)
+    ctx.tick["last"] = weakref.ref(ego)
+
+def _nearest_sep_from_peers(ctx, ego):
     if not hasattr(ego, "state"):
         return None
-    ex, ey = float(ego.state[0]), float(ego.state[1])
-    m = float("inf")
-    for w in _PEERS:
-        other = w()
-        if (other is None) or (other is ego) or (not hasattr(other, "state")):
-            continue
-        ox, oy = float(other.state[0]), float(other.state[1])
-        d = np.hypot(ox - ex, oy - ey)
-        if d < m:
-            m = d
-    return (None if m == float("inf") else m)
-
-def _wrap(a):  # wrap to [-pi,pi]
-    return (a + pi) % (2 * pi) - pi
-
-def metrics_p():
-    steps = max(_M["steps"],1)
-    report = {
-        # agent level
-        "mean_radial_error" : _M["sum_abs_er"] / steps,
-        "mean_angular_error" : _M["sum_abs_dth"] / steps,
-        "time_on_target_ratio": _M["on_target_steps"] / steps,
-
+    ex, ey = _peer_xy(ego)
+    return ctx.grid.nearest(ex, ey, skip=id(ego))
+
+def metrics_p(per_agent=False, env=None):
+    # env: the irsim environment to report on, default the one that ran last
+    ctx = _CTX.of(env)
+    steps = max(int(ctx.AG["steps"].sum()),1)
+    return _report(ctx, {
         # group level
-        "avoid_ratio":_M["avoid_steps"] / steps,
-        "min_separation": (_M["sep_min"] if _M["sep_min"] != float("inf") else None),
-        "mean_separation": (_M["sep_sum"]/_M["sep_count"] if _M["sep_count"] > 0 else None),
+        "avoid_ratio": int(ctx.AG["avoid_steps"].sum()) / steps,
+        "min_separation": (float(ctx.AG["sep_min"].min()) if np.isfinite(ctx.AG["sep_min"]).any() else None),
+        "mean_separation": (float(ctx.AG["sep_sum"].sum()) / int(ctx.AG["sep_count"].sum()) if ctx.AG["sep_count"].sum() > 0 else None),
         "steps" : steps,
-    }
-    print("[Metrics]", {k: (round(v, 4) if isinstance(v, float) else v) for k, v in report.items()})
-    return report
-
-def _ensure_circle_params(ego,**kwargs):
-    #  default value: center[5.0, 5.0],radius 1.0, changed through yaml file
-    ego.circle_center = np.array([5.0, 5.0], dtype=np.float32)
-    ego.circle_radius = 1.0
-    if "center" in kwargs:
-        ego.circle_center = np.asarray(kwargs["center"], dtype=np.float32).reshape(2)
-    if "radius" in kwargs:
-        ego.circle_radius = float(kwargs["radius"])
-    return ego.circle_center, ego.circle_radius
-
-
-def _state_features(ego,**kwargs):
-    s = np.asarray(ego.state, np.float32).reshape(-1)
-    x, y, th = float(s[0]), float(s[1]), float(s[2])
-    _C, _R = _ensure_circle_params(ego, **kwargs)
-    dx, dy = x - _C[0], y - _C[1]     # distance  to the center of the circle in x,y direction
-    phi_tan = atan2(dy, dx) + pi/2    # change to tangent direction
-    dth = _wrap(th - phi_tan)         # current direction- tangent direction
-    r=np.hypot(dx, dy)            # distance  to the center of the circle
-    e_r = r - _R  # difference between distance and R
-    dist = abs(e_r)
-    return dist, dth, e_r
-
-def _to_index(dist, dth):   # convert continuous variables into a single discrete state index
-    di = int(np.clip(dist / D_MAX * BIN_D, 0, BIN_D-1))  # convert to integers in [0,BIN_D-1]
-    ti = int(np.floor((dth + pi) / (2*pi) * BIN_TH))
-    ti = int(np.clip(ti, 0, BIN_TH-1))    # convert to integers in [0,BIN_TH-1]
-    return di * BIN_TH + ti
-
-def _adp_policy_evaluation():
-    #  (I - γP)V = R
-    S_vis = np.where(_vis > 0)[0]
-    if S_vis.size == 0:
-        return
-    P = np.zeros((S_vis.size, S_vis.size), dtype=np.float32)
-    R = np.zeros((S_vis.size,), dtype=np.float32)
-    idx_map = {s:i for i,s in enumerate(S_vis)}
-    # Naturalization: P , R
-    for si in S_vis:
-        i = idx_map[si]
-        row_sum = float(_trans[si].sum()) # sum of transitions from state si to all other states
-        if row_sum > 0:
-            for sj in S_vis:
-                j = idx_map[sj]
-                P[i, j] = _trans[si, sj] / row_sum # probability of state transitions approximated by previous counts
-        else:
-            P[i, i] = 1.0
-        R[i] = _Rsum[si] / max(_vis[si], 1)
-    A = np.eye(S_vis.size, dtype=np.float32) - _GAMMA * P
-    try:
-        V_sub = np.linalg.solve(A, R)
-    except np.linalg.LinAlgError:
-        V_sub = np.linalg.lstsq(A, R, rcond=None)[0]     #  solve the least squares problem
-    _V[S_vis] = V_sub
-
-def _shape_like_ref(u, ref_like):
-    arr = np.asarray(u, np.float32).reshape(-1)
-    ref = np.asarray(ref_like) if ref_like is not None else None
-    return arr.reshape(-1,1) if (ref is not None and ref.ndim==2) else arr
+    }, per_agent)
 
 def RL_passive(ego_object, objects=None, *args, **kwargs):
+    return _rl_passive(_CTX.of_ego(ego_object), ego_object, **kwargs)
+
+def _obstacle_xy(ctx, ego, objects):
+    # (M, 2) positions of every object in the environment (irsim hands each robot a fresh list of
+    # the others, so the first caller of a tick builds the table from its list plus itself), and
+    # the row of ego. Within the tick each call patches the rl_passive_2 robot that acted before
+    # it; objects driven by other behaviors are read once per tick.
+    if ctx.obj["tick"] != ctx.tick["n"]:
+        keep = [o for o in (*objects, ego) if hasattr(o, "state")]
+        ctx.obj["tick"] = ctx.tick["n"]
+        ctx.obj["rows"] = {id(o): i for i, o in enumerate(keep)}
+        ctx.obj["xy"] = np.array([_peer_xy(o) for o in keep], dtype=np.float64).reshape(-1, 2)
+    else:
+        prev = ctx.tick["prev"]
+        i = ctx.obj["rows"].get(id(prev)) if prev is not None else None
+        if i is not None:
+            ctx.obj["xy"][i] = _peer_xy(prev)
+    return ctx.obj["xy"], ctx.obj["rows"].get(id(ego))
 
-    global _last_state, _step
-
-    # current state
-    dist, dth, e_r = _state_features(ego_object,**kwargs)
-    state_now = _to_index(dist, dth)
-
-    # reward
-    r_now = -min(dist, D_MAX)   # the closer to the circle,the higher reward
-    if getattr(ego_object, "collision", False):
-        r_now -= 10.0
-
-    # count（previous -> current state）
-    if _last_state is not None:
-        _trans[_last_state, state_now] += 1.0
-        _vis[_last_state] += 1
-        _Rsum[_last_state] += r_now  # sum of rewards attributed to _last_state
-
-    _step += 1
-
-    # Every "_ADP_EVERY" times give an evaluation
-    if _step % _ADP_EVERY == 0:
-        _adp_policy_evaluation()
-        # print process
-        print(f"[ADP] visited={int((_vis>0).sum())}/{_S}, "
-              f"avgV={_V[_vis>0].mean():.3f}, "
-              f"mean|dist|={getattr(RL_passive,'_stat',{}).get('md',0):.3f},steps={_step}")
-
-    # constant policy
-    v = _V0     # constant linear velocity
-    w = - _KW * dth+ _KR * e_r  # angular velocity controlled by _KW and _KR * e_r
-
-    # velocity constrained to vel_min/vel_max
-    if hasattr(ego_object, "vel_min") and hasattr(ego_object, "vel_max"):
-        vmin = np.asarray(ego_object.vel_min, np.float32).reshape(-1)
-        vmax = np.asarray(ego_object.vel_max, np.float32).reshape(-1)
-        v = float(np.clip(v, vmin[0], vmax[0]))
-        w = float(np.clip(w, vmin[1], vmax[1]))
-
-    _last_state = state_now
-    _glob = getattr(RL_passive, "_stat", {"n": 0, "md": 0.0})
-    _glob["n"] += 1
-    _glob["md"] = 0.99 * _glob["md"] + 0.01 * dist    # exponential moving average
-    setattr(RL_passive, "_stat", _glob)
-    _M["steps"] += 1
-    _M["sum_abs_er"] += abs(e_r)
-    _M["sum_abs_dth"] += abs(dth)
-    if dist < _Thres:
-        _M["on_target_steps"] += 1
-    return _shape_like_ref([v, w], getattr(ego_object, "vel_min", None))
-
-def _check_obstacle(ego, objects):
+def _check_obstacle(ctx, ego, objects):
 
     if objects is None:
         return False
-    ex, ey, eth = ego.state[0], ego.state[1], ego.state[2]
-    for obj in objects:
-        if not hasattr(obj, "state"):
-            continue
-        ox, oy = obj.state[0], obj.state[1]
-        dx, dy = ox - ex, oy - ey
-        dist = np.hypot(dx, dy)
-        angle = atan2(dy, dx) - eth
-        angle = (angle + pi) % (2*pi) - pi
-        if dist < _OBS_THRESHOLD and abs(angle) < pi/4:  #  ±45°
-            return True
-    return False
+    xy, own = _obstacle_xy(ctx, ego, objects)
+    ex, ey, eth = float(ego.state[0]), float(ego.state[1]), float(ego.state[2])
+    dx, dy = xy[:, 0] - ex, xy[:, 1] - ey
+    near = dx * dx + dy * dy < _OBS_THRESHOLD ** 2 * (1 + 1e-9)   # prefilter, slack for rounding
+    if own is not None:
+        near[own] = False
+    if not near.any():
+        return False
+    dx, dy = dx[near], dy[near]
+    angle = np.arctan2(dy, dx) - eth
+    angle = (angle + pi) % (2*pi) - pi
+    return bool(np.any((np.hypot(dx, dy) < _OBS_THRESHOLD) & (np.abs(angle) < pi/4)))  #  ±45°
 
 
 
@@ -228,21 +191,24 @@ def _check_obstacle(ego, objects):
 @register_behavior("diff", "rl_passive_2")
 def subsumption_nav(ego_object, objects=None, *args, **kwargs):
     #calculate min_separation and mean_separation
-    _register_peer(ego_object)
-    min_sep = _nearest_sep_from_peers(ego_object)
+    ctx = _CTX.of_ego(ego_object)
+    _register_peer(ctx, ego_object)
+    _grid_sync(ctx, ego_object)
+    min_sep = _nearest_sep_from_peers(ctx, ego_object)
+    row = ctx.AG.row(_robot_id(ego_object))
     if min_sep is not None:
-        _M["sep_min"]  = min(_M["sep_min"], min_sep)
-        _M["sep_sum"] += min_sep
-        _M["sep_count"] += 1
+        ctx.AG["sep_min"][row] = min(ctx.AG["sep_min"][row], min_sep)
+        ctx.AG["sep_sum"][row] += min_sep
+        ctx.AG["sep_count"][row] += 1
     #obstacle judgement
     trigger_avoid = (
-        _check_obstacle(ego_object, objects) or
+        _check_obstacle(ctx, ego_object, objects) or
         (min_sep is not None and min_sep < _OBS_THRESHOLD) or
         getattr(ego_object, "collision", False)
     )
 
     if trigger_avoid: # check obstacle first
-        _M["avoid_steps"] +=1
+        ctx.AG["avoid_steps"][row] += 1
         v, w = _AVOID_SPEED, _AVOID_TURN
     else:
         v, w = RL_passive(ego_object, objects, *args, **kwargs)   #  RL_passive
@@ -3,17 +3,35 @@ import numpy as np
 import math
 import weakref
 import random
-from collections import deque
+import threading
 from movement_style import _waypoint_ve1,_circle_vel
 from collision_avoidance import _collision_avoidance_vel,_lidar
+from field_record import FieldRecorder
+from separation import PeerSeparation
 
 
 # -------------------- Global parameters --------------------
-PH_SIZE = (50, 50)            # Pheromone grid resolution (ny, nx)
+PH_CELL = 0.2                   # Pheromone cell size (m); the grid covers the world of the environment
+PH_BOUNDS = (0.0, 10.0, 0.0, 10.0)  # World (xmin, xmax, ymin, ymax) for robots outside an environment
+PH_TILE = 64                    # Cells per tile side: tiles are allocated where pheromone arrives
+PH_FREE_BELOW = 1e-6            # Free tiles whose cells all fall below this (MIN_TAU: followers cannot tell them from empty)
+PH_FREE_EVERY = 50              # Steps between checks for evaporated tiles
+PH_LAZY = False                 # True: evaporate a tile when it is read or deposited on (per-tile timestamps), not every step
+PH_DIFF_EVERY = 10              # Lazy mode: steps between passes that catch every tile up and diffuse with that many steps' blend
 PH_EVAP = 0.99                  # Evaporation factor: tau(t+1) = (1 - rho) * tau(t)
 PH_DIFF = 0.01                  # Diffusion blend (4-neighbour averaging)
 PH_DEP_L = 50.0                # Leader deposit Δτ^k
 PH_DEP_F = 5.0                  # Follower deposit Δτ^k
+PH_BILINEAR = False             # Interpolate τ at the lookahead points; off: smoothed, a follower's fresh trail outweighs the leader's
+PH_SIGNALS = {                  # Signal kind -> (evaporation, diffusion) of its channels; None: PH_EVAP / PH_DIFF
+    "trail": (None, None),
+    "alarm": (0.90, 0.05),
+    "repel": (0.97, 0.02),
+}
+PH_AVOID = 1.0                  # Weight of the `avoid` channel: τ / (1 + w * avoid)
+PH_RECORD = None                # Path of a field_record ring file to record the field and poses to (None: off)
+PH_RECORD_EVERY = 10            # Steps between recorded frames
+PH_RECORD_SLOTS = 200           # Frames kept in the ring
 
 # ACO exponents and policy
 ALPHA = 2.0                     # Weight of pheromone τ^α
@@ -34,54 +52,456 @@ VN, KW = 0.75, 2.0              # Nominal forward speed scale & turn gain
 DESIRED_D = 0.5                 # Desired minimum separation between agents
 
 
-# Shared state
-_LEADER_POSE = None             # Cached leader pose (x, y, theta)
-_FIELD = None                   # Global pheromone field instance
-_STEP_OWNER = 0                 # Robot id responsible for advancing the field step()
-
 PATH_BAND = 0.5                # To decide whether follower is on the path
-_LEAD_PATH = deque(maxlen=500)  # leader path storage
 
 
 # -------------------- Pheromone field & metrics --------------------
 class _Field:
-    """Simple 2D grid representing pheromone intensity with evaporation and diffusion."""
+    """
+    Pheromone intensities on a grid of PH_CELL cells covering `bounds`, one channel per signal
+    (a team's trail, alarm, repulsion, ...), each with its own evaporation and diffusion.
+    The grid is stored as PH_TILE x PH_TILE tiles in one (slots, channels, T, T) pool: a tile is allocated
+    when pheromone first reaches it and freed once every channel has evaporated, so memory follows the
+    area the colonies have visited, and one step() advances every channel.
+    Lazy mode keeps the tick each tile was last evaporated at and applies PH_EVAP**Δt when the tile is read
+    or deposited on; step() then only advances the clock, and every PH_DIFF_EVERY steps catches all tiles up
+    and diffuses once with the blend of that many steps (exact for PH_DIFF_EVERY = 1, an approximation above).
+    """
 
-    def __init__(self, bounds):
-        self.bounds = tuple(bounds)
-        ny, nx = PH_SIZE
-        self.g = np.zeros((ny, nx), np.float32)
+    def __init__(self, bounds, cell=None, channels=("trail",), lazy=None):
+        self.bounds = tuple(float(b) for b in bounds)
+        xmin, xmax, ymin, ymax = self.bounds
+        self.cell = float(cell or PH_CELL)
+        T = self.T = PH_TILE
+        self.nx = max(1, int(math.ceil((xmax - xmin) / self.cell - 1e-9)))    # cells inside the world
+        self.ny = max(1, int(math.ceil((ymax - ymin) / self.cell - 1e-9)))
+        self.ntx, self.nty = -(-self.nx // T), -(-self.ny // T)
+        self.ex = self.nx - (self.ntx - 1) * T                      # cells of the last tile column inside the world
+        self.ey = self.ny - (self.nty - 1) * T
+        self.tmap = np.full((self.nty, self.ntx), -1, np.int64)     # tile (ty, tx) -> pool slot, -1: not allocated
+        self.key = np.zeros((0,), np.int64)                         # pool slot -> tile ty * ntx + tx
+        self.stamp = np.zeros((0,), np.int64)                       # pool slot -> tick it is evaporated up to (lazy)
+        self.lazy = PH_LAZY if lazy is None else bool(lazy)
+        self.names = []                                             # channel index -> name
+        self.evap = np.zeros((0, 1, 1))                             # per channel, shaped to broadcast over tiles
+        self.diff = np.zeros((0, 1, 1))
+        self.pool = np.zeros((0, 0, T, T), np.float32)              # pool[:n] holds the allocated tiles
+        self._nb = np.zeros_like(self.pool)                         # scratch: neighbour sums for step()
+        self.n = 0
+        self._halo = None               # halo gather indices per live tile, rebuilt after tiles come or go
+        self._hb = self._fb = self._rb = None   # scratch for the halo, frontier and rim gathers
+        self._front = None              # own edges facing an empty neighbour, and that neighbour's tile
+        self._rim = None                # reflection copies and padding cells where the world ends inside a tile
+        self.tick = 0
+        self._checked = 0               # tick of the last check for evaporated tiles
+        for name in channels:
+            self.channel(name)
+
+    # ---- channels ----
+    def channel(self, name):
+        """
+        Index of the channel `name`, added on first use with the PH_SIGNALS constants of its kind
+        (the part before ':', e.g. "trail:2" is a trail).
+        """
+        if name in self.names:
+            return self.names.index(name)
+        evap, diff = PH_SIGNALS.get(str(name).split(":")[0], (None, None))
+        self.names.append(name)
+        self.evap = np.append(self.evap, PH_EVAP if evap is None else evap).reshape(-1, 1, 1)
+        self.diff = np.append(self.diff, PH_DIFF if diff is None else diff).reshape(-1, 1, 1)
+        # tau <- evap * ((1 - d) * tau + d/4 * neighbour sum), as float32 so step() scales in place
+        self._rates = ((self.evap * (1.0 - self.diff)).astype(np.float32),
+                       (self.evap * self.diff * 0.25).astype(np.float32))
+        cap, C, T = len(self.pool), len(self.names), self.T
+        pool = np.zeros((cap, C, T, T), np.float32)
+        pool[:, :C - 1] = self.pool
+        self.pool, self._nb = pool, np.zeros_like(pool)
+        self._halo = None               # gather indices depend on the channel count
+        return C - 1
+
+    # ---- tiles ----
+    def _resize(self, cap):
+        T, n, C = self.T, self.n, len(self.names)
+        pool = np.zeros((cap, C, T, T), np.float32)
+        pool[:n] = self.pool[:n]
+        self.pool, self._nb = pool, np.zeros_like(pool)
+        key = np.zeros((cap,), np.int64)
+        key[:n] = self.key[:n]
+        self.key = key
+        stamp = np.zeros((cap,), np.int64)
+        stamp[:n] = self.stamp[:n]
+        self.stamp = stamp
+
+    def _alloc(self, keys):
+        """
+        Allocate zeroed tiles for the flat tile indices `keys` (not allocated yet).
+        """
+        keys = np.unique(np.asarray(keys, np.int64))
+        n, m = self.n, keys.size
+        if n + m > len(self.pool):
+            self._resize(max(2 * len(self.pool), n + m, 4))
+        self.pool[n:n + m] = 0.0
+        self.key[n:n + m] = keys
+        self.stamp[n:n + m] = self.tick
+        self.tmap.flat[keys] = np.arange(n, n + m)
+        self.n = n + m
+        self._halo = None
+
+    def _free_evaporated(self):
+        """
+        Free the tiles whose cells have all evaporated below PH_FREE_BELOW.
+        """
+        self._checked = self.tick
+        if self.lazy:
+            self._sync()
+        n = self.n
+        dead = np.flatnonzero(self.pool[:n].reshape(n, -1).max(axis=1) < PH_FREE_BELOW)
+        for s in dead[::-1]:            # from the back, moving the last live tile into each hole
+            last = self.n - 1
+            self.tmap.flat[self.key[s]] = -1
+            if s != last:
+                self.pool[s] = self.pool[last]
+                self.key[s] = self.key[last]
+                self.stamp[s] = self.stamp[last]
+                self.tmap.flat[self.key[s]] = s
+            self.n -= 1
+        if dead.size:
+            self._halo = None
+            cap = len(self.pool)
+            while cap > 4 and self.n < cap // 4:
+                cap //= 2
+            if cap < len(self.pool):
+                self._resize(cap)
+
+    def _catch_up(self, slots):
+        """
+        Lazy mode: evaporate the tiles in `slots` (distinct pool slots) up to the current tick.
+        """
+        dt = self.tick - self.stamp[slots]
+        stale = dt > 0
+        if stale.any():
+            s = slots[stale]
+            self.pool[s] *= (self.evap[None] ** dt[stale][:, None, None, None]).astype(np.float32)
+            self.stamp[s] = self.tick
+
+    def _sync(self):
+        """
+        Lazy mode: evaporate every live tile up to the current tick.
+        """
+        self._catch_up(np.arange(self.n))
 
-    def _idx(self, x, y):
+    def _gather(self, slots, line, rows):
         """
-        Convert world coordinates to grid indices clamped to grid extent.
+        Flat pool indices (len(slots), C, T) of one row (rows=True) or column of each slot, every channel.
         """
-        xmin, xmax, ymin, ymax = self.bounds
-        ny, nx = PH_SIZE
-        u = (x - xmin) / max(1e-9, (xmax - xmin))
-        v = (y - ymin) / max(1e-9, (ymax - ymin))
-        ix = int(np.clip(u * (nx - 1), 0, nx - 1))
-        iy = int(np.clip(v * (ny - 1), 0, ny - 1))
+        T, C = self.T, len(self.names)
+        s = np.asarray(slots, np.int64)[:, None, None]
+        ln = np.asarray(line, np.int64).reshape(-1, 1, 1)
+        ch, k = np.arange(C)[None, :, None], np.arange(T)[None, None, :]
+        return ((s * C + ch) * T + ln) * T + k if rows else ((s * C + ch) * T + k) * T + ln
+
+    def _halos(self):
+        """
+        For each live tile and side (+y, -y, +x, -x): flat pool indices of the row/column bordering it in the
+        neighbour tile, and a 0/1 mask for empty neighbours (None when there are none). At the grid border the
+        tile's own edge is used (no flux through it). Also caches the frontier (own edges facing an empty
+        neighbour) for _grow, the rim copies that reflect the world's edge inside the last tile column and row,
+        and the scratch the step gathers into: rebuilt only when tiles come or go, so a step copies no part of the pool.
+        """
+        if self._halo is None:
+            T, n, ntx = self.T, self.n, self.ntx
+            ty, tx = np.divmod(self.key[:n], ntx)
+            me = np.arange(n)
+            halo, front, fkey = [], [], []
+            for dy, dx in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                y, x = ty + dy, tx + dx
+                inside = (y >= 0) & (y < self.nty) & (x >= 0) & (x < ntx)
+                src = np.where(inside, self.tmap[np.clip(y, 0, self.nty - 1), np.clip(x, 0, ntx - 1)], me)
+                empty = src < 0
+                edge = T - 1 if dy + dx > 0 else 0
+                line = np.where(inside, T - 1 - edge, edge)
+                mask = (~empty).astype(np.float32)[:, None, None] if empty.any() else None
+                halo.append((self._gather(np.where(empty, me, src), line, dx == 0), mask))
+                if empty.any():
+                    front.append(self._gather(me[empty], edge, dx == 0).reshape(int(empty.sum()), -1))
+                    fkey.append(self.key[:n][empty] + dy * ntx + dx)
+            self._halo = halo
+            C = len(self.names)
+            self._hb = np.empty((n, C, T), np.float32)
+            self._front = (np.concatenate(front), np.concatenate(fkey)) if front else None
+            self._fb = np.empty(self._front[0].shape, np.float32) if front else None
+            # world edge inside a tile: copy the last row/column into the first padding one before the sum,
+            # so the neighbour read there reflects like the grid border; padding is zeroed after the step
+            src, dst, pad = [], [], []
+            ex, ey = self.ex, self.ey
+            rx = me[tx == self.ntx - 1] if ex < T else me[:0]
+            ry = me[ty == self.nty - 1] if ey < T else me[:0]
+            if rx.size:
+                src.append(self._gather(rx, ex - 1, False).reshape(-1))
+                dst.append(self._gather(rx, ex, False).reshape(-1))
+                pad += [self._gather(rx, c, False).reshape(-1) for c in range(ex, T)]
+            if ry.size:
+                src.append(self._gather(ry, ey - 1, True).reshape(-1))
+                dst.append(self._gather(ry, ey, True).reshape(-1))
+                pad += [self._gather(ry, r, True).reshape(-1) for r in range(ey, T)]
+            self._rim = (np.concatenate(src), np.concatenate(dst), np.unique(np.concatenate(pad))) if src else None
+            self._rb = np.empty(self._rim[0].shape, np.float32) if src else None
+        return self._halo
+
+    def _grow(self):
+        """
+        Allocate the empty neighbours that diffusion is about to carry pheromone into.
+        """
+        self._halos()
+        if self._front is None:
+            return
+        idx, keys = self._front
+        np.take(self.pool.reshape(-1), idx, out=self._fb, mode="clip")
+        want = self._fb.max(axis=1) >= PH_FREE_BELOW
+        if want.any():
+            self._alloc(keys[want])
+
+    def _diffuse(self, rates=None):
+        """
+        pool <- keep * pool + spread * (4-neighbour sum) over every live tile and channel, edges taken
+        from the neighbours; keep and spread are per channel. The world's edge reflects like the grid
+        border, also where it falls inside a tile, and the padding cells beyond it stay at zero.
+        Halos are gathered with precomputed indices into scratch from _halos(): no copies of the pool.
+        """
+        self._grow()
+        n = self.n
+        flat = self.pool.reshape(-1)
+        halo = self._halos()
+        P, nb, hb = self.pool[:n], self._nb[:n], self._hb
+        if self._rim is not None:
+            src, dst, _ = self._rim
+            np.take(flat, src, out=self._rb, mode="clip")
+            np.put(flat, dst, self._rb)
+        for k, (idx, mask) in enumerate(halo):
+            np.take(flat, idx, out=hb, mode="clip")
+            if mask is not None:
+                hb *= mask
+            if k == 0:
+                nb[:, :, :-1] = P[:, :, 1:]
+                nb[:, :, -1] = hb
+                nb[:, :, 1:] += P[:, :, :-1]
+            elif k == 1:
+                nb[:, :, 0] += hb
+            elif k == 2:
+                nb[:, :, :, :-1] += P[:, :, :, 1:]
+                nb[:, :, :, -1] += hb
+                nb[:, :, :, 1:] += P[:, :, :, :-1]
+            else:
+                nb[:, :, :, 0] += hb
+        keep, spread = rates or self._rates
+        nb *= spread
+        P *= keep
+        P += nb
+        if self._rim is not None:
+            np.put(flat, self._rim[2], 0.0)
+
+    # ---- cells ----
+    def _index(self, xs, ys):
+        xmin, _, ymin, _ = self.bounds
+        ix = np.clip((np.asarray(xs, float).reshape(-1) - xmin) // self.cell, 0, self.nx - 1).astype(np.intp)
+        iy = np.clip((np.asarray(ys, float).reshape(-1) - ymin) // self.cell, 0, self.ny - 1).astype(np.intp)
         return iy, ix
 
     def step(self):
-        """Apply evaporation and 4-neighbour diffusion in-place."""
-        g = self.g
-        g *= PH_EVAP
-        if PH_DIFF > 0.0:
-            up = np.roll(g, -1, 0)
-            dn = np.roll(g, +1, 0)
-            lf = np.roll(g, -1, 1)
-            rt = np.roll(g, +1, 1)
-            self.g[:] = (1.0 - PH_DIFF) * g + PH_DIFF * 0.25 * (up + dn + lf + rt)
-
-    def deposit(self, x, y, amt):
-        iy, ix = self._idx(x, y)
-        self.g[iy, ix] += float(amt)
-
-    def val_at(self, x, y):
-        iy, ix = self._idx(x, y)
-        return float(self.g[iy, ix])
+        """
+        Apply evaporation and 4-neighbour diffusion to every channel of the live tiles, in place.
+        Lazy mode only advances the clock, and every PH_DIFF_EVERY steps catches the tiles up and diffuses them.
+        """
+        self.tick += 1
+        if self.n == 0:
+            return
+        if self.lazy:
+            if self.tick % max(1, PH_DIFF_EVERY) == 0:
+                self._sync()
+                if (self.diff > 0.0).any():
+                    # the blend of PH_DIFF_EVERY steps at once, evaporation already applied by _sync()
+                    keep = (1.0 - self.diff) ** max(1, PH_DIFF_EVERY)
+                    self._diffuse((keep.astype(np.float32), ((1.0 - keep) * 0.25).astype(np.float32)))
+        elif (self.diff > 0.0).any():
+            self._diffuse()
+        else:
+            self.pool[:self.n] *= self._rates[0]
+        if self.tick - self._checked >= PH_FREE_EVERY:
+            self._free_evaporated()
+
+    def deposit(self, x, y, amt, channel=0):
+        self.deposit_many([x], [y], amt, channel)
+
+    def deposit_many(self, xs, ys, amounts, channels=0):
+        """
+        Add amounts[i] on channels[i] at (xs[i], ys[i]) for all points at once; points sharing a cell accumulate.
+        """
+        T = self.T
+        iy, ix = self._index(xs, ys)
+        tile = (iy // T) * self.ntx + ix // T
+        missing = self.tmap.flat[tile] < 0
+        if missing.any():
+            self._alloc(tile[missing])
+        cell = (self.tmap.flat[tile], iy % T, ix % T)
+        if self.lazy:
+            self._catch_up(np.unique(cell[0]))
+        ch = np.broadcast_to(np.asarray(channels, np.intp), ix.shape)
+        np.add.at(self.pool, (cell[0], ch, cell[1], cell[2]),
+                  np.broadcast_to(np.asarray(amounts, np.float32), ix.shape))
+
+    def val_at(self, x, y, channel=0, pending=None):
+        return float(self.sample([x], [y], channel=channel, pending=pending)[0])
+
+    def _cells(self, iy, ix, channel, pending=None):
+        """
+        Current values of the cells (iy, ix) (integer arrays inside the grid) on one channel; 0 in unallocated tiles.
+        pending: (xs, ys, amounts, channels) of deposits not laid yet, counted as if they were.
+        """
+        T = self.T
+        s = self.tmap[iy // T, ix // T]
+        live = s >= 0
+        out = np.zeros(s.shape, float)
+        cell = (s[live], iy[live] % T, ix[live] % T)
+        out[live] = self.pool[cell[0], channel, cell[1], cell[2]]
+        if self.lazy:
+            out[live] *= self.evap[channel, 0, 0] ** (self.tick - self.stamp[cell[0]])
+        if pending is not None and len(pending[0]):
+            px, py, amts, chans = pending
+            piy, pix = self._index(px, py)
+            amts = np.where(np.asarray(chans) == channel, np.asarray(amts, float), 0.0)
+            out += ((iy[:, None] == piy) & (ix[:, None] == pix)) @ amts
+        return out
+
+    def sample(self, xs, ys, bilinear=False, channel=0, pending=None):
+        """
+        Intensities on `channel` at arrays of points: the containing cell, or bilinear between the four
+        nearest cell centres. `pending` deposits (see _cells) are included without laying them.
+        """
+        xmin, _, ymin, _ = self.bounds
+        xs, ys = np.asarray(xs, float), np.asarray(ys, float)
+        if not bilinear:
+            ix = np.clip((xs - xmin) // self.cell, 0, self.nx - 1).astype(np.intp)
+            iy = np.clip((ys - ymin) // self.cell, 0, self.ny - 1).astype(np.intp)
+            return self._cells(iy, ix, channel, pending)
+        u, v = (xs - xmin) / self.cell, (ys - ymin) / self.cell
+        u = np.clip(u - 0.5, 0.0, self.nx - 1)      # cell centres sit at (i + 0.5) * cell
+        v = np.clip(v - 0.5, 0.0, self.ny - 1)
+        ix0, iy0 = u.astype(np.intp), v.astype(np.intp)
+        ix1, iy1 = np.minimum(ix0 + 1, self.nx - 1), np.minimum(iy0 + 1, self.ny - 1)
+        fx, fy = u - ix0, v - iy0
+        # one gather for the four corners
+        c = self._cells(np.concatenate([iy0, iy0, iy1, iy1]).reshape(-1),
+                        np.concatenate([ix0, ix1, ix0, ix1]).reshape(-1), channel, pending)
+        c00, c01, c10, c11 = c.reshape(4, -1)
+        shape = np.shape(u)
+        fx, fy = fx.reshape(-1), fy.reshape(-1)
+        return ((c00 * (1 - fx) + c01 * fx) * (1 - fy) + (c10 * (1 - fx) + c11 * fx) * fy).reshape(shape)
+
+    # ---- dense views ----
+    def _dense_tiles(self, g):
+        # (C, nty, ntx, T, T) view of a dense (C, nty*T, ntx*T) array, tile by tile
+        T = self.T
+        v = g.view()
+        v.shape = (len(g), self.nty, T, self.ntx, T)     # raises rather than copy, writes must reach g
+        return v.transpose(0, 1, 3, 2, 4)
+
+    def dense_into(self, out):
+        """
+        Write the current intensities into out, a C-contiguous (channels, nty*T, ntx*T) array
+        (the grid padded to whole tiles): one zero fill and one scatter of the live tiles.
+        """
+        if self.lazy:
+            self._sync()
+        n = self.n
+        P = self.pool[:n]
+        ty, tx = np.divmod(self.key[:n], self.ntx)
+        out[...] = 0.0
+        self._dense_tiles(out)[:, ty, tx] = P.transpose(1, 0, 2, 3)
+        return out
+
+    def snapshot(self, channel=None):
+        """
+        Dense copy of the current intensities: (ny, nx) for one channel, (channels, ny, nx) by default.
+        """
+        T = self.T
+        out = self.dense_into(np.empty((len(self.names), self.nty * T, self.ntx * T), np.float32))
+        out = out[:, :self.ny, :self.nx]
+        return out if channel is None else out[channel]
+
+    def load(self, g):
+        """
+        Replace the field with the dense array g: (ny, nx) for channel 0 or (channels, ny, nx),
+        at most the grid's size and anchored at the lower-left cell.
+        """
+        T = self.T
+        g = np.asarray(g, np.float32)
+        if g.ndim == 2:
+            g = g[None]
+        full = np.zeros((len(self.names), self.nty * T, self.ntx * T), np.float32)
+        full[:len(g), :g.shape[1], :g.shape[2]] = g
+        tiles = self._dense_tiles(full)                         # (C, nty, ntx, T, T)
+        self.tmap[:] = -1
+        self.n = 0
+        keys = np.flatnonzero(tiles.any(axis=(0, 3, 4)))
+        self._alloc(keys)
+        self.pool[:self.n] = tiles.reshape(len(full), -1, T, T)[:, keys].transpose(1, 0, 2, 3)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the tile pool."""
+        return self.pool.nbytes + self._nb.nbytes
+
+
+# -------------------- Per-environment state --------------------
+class _Context:
+    """Shared state of one irsim environment: field, team leaders, path and metric accumulators."""
+
+    def __init__(self):
+        self.leaders = {}                       # Cached leader pose (x, y, theta) per team
+        self.field = None                       # Pheromone field instance
+        self.step_owner = 0                     # Robot id responsible for advancing the field step()
+        self.deposits = ([], [], [], [])        # x, y, amount, channel queued since the last step
+        self.lead_paths = {}                    # team -> _PathIndex of its leader's recent positions
+        self.recorder = None                    # FieldRecorder when PH_RECORD is set
+        self.m = {
+            "steps": 0,
+            "sum_dist_to_leader": 0.0,
+            "leader_samples": 0,
+            "sum_inter_member_dist": 0.0,
+            "follower_count": 0,
+            "onpath_hits": 0,
+            "follower_samples": 0,
+            "pheromone_sum": 0.0,
+            "sum_min_sep": 0.0,
+            "min_sep_samples": 0,
+        }
+        self.sep = PeerSeparation()             # robots seen by metrics() and their separations this tick
+
+
+_CTX = weakref.WeakKeyDictionary()      # irsim environment -> _Context, dropped with the environment
+_CTX_LOCK = threading.Lock()
+_DEFAULT = _Context()                   # robots without an environment
+_LAST = [_DEFAULT]                      # context of the latest call, reported by metrics_report()
+
+
+def _env_context(env):
+    if env is None:
+        return _DEFAULT
+    ctx = _CTX.get(env)
+    if ctx is None:
+        with _CTX_LOCK:
+            ctx = _CTX.get(env)
+            if ctx is None:
+                ctx = _CTX[env] = _Context()
+    return ctx
+
+
+def _context(ego):
+    """
+    Context of the environment `ego` lives in.
+    """
+    ctx = _LAST[0] = _env_context(getattr(ego, "_env", None))
+    return ctx
 
 # -------------------- IR-SIM adapters --------------------
 def _pose(ego):
@@ -101,17 +521,76 @@ def _is_leader(ego, kwargs):
     return False
 
 
-def _get_field(ego):
+def _get_field(ctx, ego):
     """
-    Retrieve or lazily create the global pheromone field.
+    Retrieve or lazily create the pheromone field of the context.
     """
-    global _FIELD, _STEP_OWNER
-    if _FIELD is None:
-        # World bounds are assumed to be [0,10]x[0,10]; adjust if needed.
-        bounds = (0.0, 10.0, 0.0, 10.0)
-        _FIELD = _Field(bounds)
-        _STEP_OWNER = getattr(ego, "id", 0)
-    return _FIELD
+    if ctx.field is None:
+        ctx.field = _Field(_world_bounds(ego))
+        ctx.step_owner = getattr(ego, "id", 0)
+    return ctx.field
+
+
+def _flush_deposits(ctx, field):
+    """
+    Lay every deposit queued since the last step, in one deposit_many call; the step owner calls it once
+    per tick before step(). Until then reads pass the queue as `pending`, so each robot still sees the
+    deposits of the robots that acted before it in the tick, as if they had been laid at once.
+    """
+    xs, ys, amts, chans = ctx.deposits
+    if xs:
+        field.deposit_many(xs, ys, amts, chans)
+        for q in ctx.deposits:
+            q.clear()
+
+
+def _record(ctx, ego, field):
+    """
+    Append the field and the pose of every robot in the environment to the PH_RECORD ring file.
+    """
+    env = getattr(ego, "_env", None)
+    if env is None:
+        return
+    robots = [o for o in env.objects if getattr(o, "role", "robot") != "obstacle"]    # robot_list drops the leader
+    ids, roles = [_robot_id(r) for r in robots], [getattr(r, "role", None) for r in robots]
+    if ctx.recorder is None:
+        ctx.recorder = FieldRecorder(PH_RECORD, field, ids, roles, PH_RECORD_SLOTS)
+    elif not ctx.recorder.matches(field, ids):      # a channel or a robot was added since the last frame
+        ctx.recorder.reshape(field, ids, roles)
+    poses = np.concatenate([np.asarray(r.state[:3], np.float32).reshape(1, 3) for r in robots])
+    ctx.recorder.record(field.tick, poses, field)
+
+
+def _signals(field, ego, kwargs):
+    """
+    (team, deposit channel, follow channel, avoid channel or None) from the behavior's YAML kwargs.
+    `team` (default 0) picks the team's trail, which the robot lays and follows unless `deposit` or
+    `follow` name another channel (e.g. "alarm"); `avoid` names a channel that repels it.
+    """
+    team = kwargs.get("team", 0)
+    if getattr(ego, "team", None) != team:
+        ego.team = team
+    trail = "trail" if team == 0 else f"trail:{team}"
+    avoid = kwargs.get("avoid")
+    return (team, field.channel(kwargs.get("deposit", trail)), field.channel(kwargs.get("follow", trail)),
+            None if avoid is None else field.channel(avoid))
+
+
+def _world_bounds(ego):
+    """
+    (xmin, xmax, ymin, ymax) of the world `ego` lives in: irsim's world, grown to the
+    `world: map: size: [w, h]` of our yaml files (irsim itself does not read that key).
+    """
+    env = getattr(ego, "_env", None)
+    world = getattr(env, "_world", None)
+    if world is None:
+        return PH_BOUNDS
+    (x0, x1), (y0, y1) = world.x_range, world.y_range
+    cfg = getattr(getattr(env, "env_config", None), "parse", None) or {}
+    size = ((cfg.get("world") or {}).get("map") or {}).get("size")
+    if size is not None:
+        x1, y1 = max(x1, x0 + float(size[0])), max(y1, y0 + float(size[1]))
+    return float(x0), float(x1), float(y0), float(y1)
 
 
 def _shape_like_ref(u, ref_like):
@@ -135,167 +614,206 @@ def _agent_limits(ego):
     return vmax, wmax
 
 # -------------------- ACO helpers (η, p, sampling) --------------------
-def _leader_pose(objects):
+def _leader_pose(ctx, objects, team=0):
     """
-    Find leader pose.
+    Find the pose of the team's leader.
     """
     if isinstance(objects, (list, tuple)):
         for o in objects:
-            if getattr(o, "role", "") == "leader":
+            if getattr(o, "role", "") == "leader" and getattr(o, "team", 0) == team:
                 return _pose(o)
-    return _LEADER_POSE
+    return ctx.leaders.get(team)
 
 
-def _clearance_in_heading(ego, hdg):
+def _clearance_in_headings(ang, rng, rel):
     """
-    Return lidar clearance along an absolute heading (metres, clipped).
+    Lidar clearance along headings `rel` relative to the robot (metres, clipped), from one scan.
     """
-    th = _pose(ego)[2]
-    ang, rng = _lidar(ego)
     if ang is None or len(ang) == 0 or len(rng) == 0:
-        return 0.5  # Fallback if lidar not available
-    rel = (hdg - th + math.pi) % (2 * math.pi) - math.pi
-    idx = int(np.argmin(np.abs(ang - rel)))
-    r = float(rng[idx]) if np.isfinite(rng[idx]) and rng[idx] > 0.0 else 0.0
-    return max(0.0, r)
+        return np.full(rel.shape, 0.5)  # Fallback if lidar not available
+    idx = np.argmin(np.abs(ang[None, :] - rel[:, None]), axis=1)   # nearest beam per heading
+    r = rng[idx]
+    return np.where(np.isfinite(r) & (r > 0.0), r, 0.0)
 
 
-def _heuristic_eta(ego, objects, x, y, hdg):
+def _heuristic_eta(ctx, ego, objects, th, hdgs, x2, y2, team=0):
     """
-    Heuristic η combines clearance (lidar) and attractiveness to the leader.
+    Heuristic η per candidate heading: clearance (lidar) plus attractiveness to the leader,
+    evaluated at the lookahead points (x2, y2).
     """
-    clr = _clearance_in_heading(ego, hdg)
-    clr_score = clr
-    lp = _leader_pose(objects)
+    ang, rng = _lidar(ego)
+    rel = (hdgs - th + math.pi) % (2 * math.pi) - math.pi
+    clr_score = _clearance_in_headings(ang, rng, rel)
+    lp = _leader_pose(ctx, objects, team)
     if lp is None:
         lead_score = 0.0
     else:
         xl, yl, _ = lp
-        x2 = x + LOOKAHEAD * math.cos(hdg)
-        y2 = y + LOOKAHEAD * math.sin(hdg)
-        d = math.hypot(x2 - xl, y2 - yl)
+        d = np.hypot(x2 - xl, y2 - yl)
         lead_score = 1.0 / (1e-6 + d)
     eta = ETA_W_CLEAR * clr_score + ETA_W_LEADER * lead_score
-    return max(1e-9, eta)
+    return np.maximum(1e-9, eta)
 
 
-def _sample_heading_by_tau_eta(field, ego, objects, x, y, th):
+def _sample_heading_by_tau_eta(ctx, field, ego, objects, x, y, th, sig):
     """
     Discretise candidate headings; compute τ,η then sample with p ∝ τ^α η^β.
+    sig: _signals() of the robot, τ is read from its follow channel and damped by its avoid channel.
     """
+    team, _, follow, avoid = sig
     angles = th + np.linspace(-math.pi, math.pi, N_DIR, endpoint=False)
-    tau = np.zeros(N_DIR, float)
-    eta = np.zeros(N_DIR, float)
+    x2 = x + LOOKAHEAD * np.cos(angles)
+    y2 = y + LOOKAHEAD * np.sin(angles)
+    tau = np.maximum(MIN_TAU, field.sample(x2, y2, PH_BILINEAR, follow, ctx.deposits))
+    if avoid is not None:
+        tau = tau / (1.0 + PH_AVOID * field.sample(x2, y2, PH_BILINEAR, avoid, ctx.deposits))
+    eta = _heuristic_eta(ctx, ego, objects, th, angles, x2, y2, team)
 
-    for i, hdg in enumerate(angles):
-        x2 = x + LOOKAHEAD* math.cos(hdg)
-        y2 = y + LOOKAHEAD* math.sin(hdg)
-        tau[i] = max(MIN_TAU, field.val_at(x2, y2))
-        eta[i] = _heuristic_eta(ego, objects, x, y, hdg)
-
-    if np.max(eta) > 0:
-        eta = eta / (np.max(eta) + 1e-9)
+    eta_max = eta.max()
+    if eta_max > 0:
+        eta = eta / (eta_max + 1e-9)
 
     score = np.power(tau, ALPHA) * np.power(eta, BETA)
 
     if random.random() < Q0:
         k = int(np.argmax(score))
     else:
-        s = np.sum(score)
+        cdf = np.cumsum(score)
+        s = cdf[-1]
         if s <= 0.0 or not np.isfinite(s):
             k = int(np.argmax(score))
         else:
-            p = score / s
-            k = int(np.random.choice(np.arange(N_DIR), p=p))
+            # roulette: one uniform draw against the cumulative scores
+            k = min(int(np.searchsorted(cdf, np.random.random() * s, side="right")), N_DIR - 1)
     return float(angles[k])
 
 # -------------------- Evaluation --------------------
-_M = {
-    "steps": 0,
-    "sum_dist_to_leader": 0.0,
-    "sum_inter_member_dist": 0.0,
-    "follower_count": 0,
-    "onpath_hits": 0,
-    "follower_samples": 0,
-    "pheromone_sum": 0.0,
-}
+def _seg_dist(px, py, x1, y1, x2, y2):
+    """
+    Distance from points (px, py) to segments (x1, y1)-(x2, y2), broadcasting.
+    """
+    dx, dy = x2 - x1, y2 - y1
+    L2 = dx * dx + dy * dy
+    t = np.clip(((px - x1) * dx + (py - y1) * dy) / np.where(L2 > 1e-12, L2, 1.0), 0.0, 1.0)
+    return np.hypot(px - (x1 + t * dx), py - (y1 + t * dy))
 
-_PEERS = []
 
-def _register_peer(ego):
-    for w in _PEERS:
-        if w() is ego:
-            return
-    _PEERS.append(weakref.ref(ego))
-
-def _average_sep_from_peers(ego):
-    count = 1
-    sum_sep = 0
-    if not hasattr(ego, "state"):
-        return None
-    ex, ey = float(ego.state[0]), float(ego.state[1])
-    for w in _PEERS:
-        other = w()
-        if (other is None) or (other is ego) or (not hasattr(other, "state")):
-            continue
-        ox, oy = float(other.state[0]), float(other.state[1])
-        d = np.hypot(ox - ex, oy - ey)
-        sum_sep += d
-        count +=1
-    return sum_sep/count
-
-def _min_dist_to_polyline(px, py, poly):
-
-    if not poly:
-        return float("inf")
-    it = iter(poly)
-    x1, y1 = next(it)
-    best = math.hypot(px - x1, py - y1)  
-    for x2, y2 in it:
-        dx, dy = (x2 - x1), (y2 - y1)
-        seg_len2 = dx*dx + dy*dy
-        if seg_len2 <= 1e-12:
+class _PathIndex:
+    """
+    The last `maxlen` leader positions as a polyline, with each segment listed in the grid cells
+    (side `cell`) its bounding box touches, so a query near the path only measures nearby segments.
+    Point k lives in slot k % maxlen; segment k joins points k and k + 1.
+    """
+
+    def __init__(self, maxlen=500, cell=None):
+        self.maxlen = maxlen
+        self.cell = float(cell or PATH_BAND)
+        self.xy = np.zeros((maxlen, 2))
+        self.first = 0                  # id of the oldest point kept
+        self.next = 0                   # id of the next point
+        self.cells = {}                 # (cx, cy) -> set of segment ids
+
+    def __len__(self):
+        return self.next - self.first
+
+    def _seg_cells(self, k):
+        (x1, y1), (x2, y2) = self.xy[k % self.maxlen], self.xy[(k + 1) % self.maxlen]
+        c = self.cell
+        for cx in range(int(min(x1, x2) // c), int(max(x1, x2) // c) + 1):
+            for cy in range(int(min(y1, y2) // c), int(max(y1, y2) // c) + 1):
+                yield cx, cy
+
+    def append(self, x, y):
+        if len(self) == self.maxlen:    # evict the oldest point and its segment
+            k = self.first
+            for key in self._seg_cells(k):
+                bucket = self.cells.get(key)
+                if bucket is not None:
+                    bucket.discard(k)
+                    if not bucket:
+                        del self.cells[key]
+            self.first += 1
+        self.xy[self.next % self.maxlen] = (x, y)
+        self.next += 1
+        if len(self) >= 2:
+            k = self.next - 2
+            for key in self._seg_cells(k):
+                self.cells.setdefault(key, set()).add(k)
+
+    def _segments(self, ids):
+        a = self.xy[ids % self.maxlen]
+        b = self.xy[(ids + 1) % self.maxlen]
+        return a[..., 0], a[..., 1], b[..., 0], b[..., 1]
+
+    def dist(self, px, py, radius):
+        """
+        Distance from (px, py) to the path if it is within `radius`, else inf (only cells in reach are checked).
+        """
+        if len(self) == 0:
+            return float("inf")
+        if len(self) == 1:
+            x1, y1 = self.xy[self.first % self.maxlen]
             d = math.hypot(px - x1, py - y1)
-        else:
-            t = ((px - x1)*dx + (py - y1)*dy) / seg_len2
-            t = max(0.0, min(1.0, t))
-            qx, qy = (x1 + t*dx, y1 + t*dy)
-            d = math.hypot(px - qx, py - qy)
-        if d < best:
-            best = d
-        x1, y1 = x2, y2
-    return best
-
-def metrics(ego, is_leader):
-    global _M, _PEERS
-
-    _M["steps"] += 1
-    _register_peer(ego)
+            return d if d <= radius else float("inf")
+        c = self.cell
+        r = int(math.ceil(radius / c))
+        cx, cy = int(px // c), int(py // c)
+        ids = set()
+        for i in range(cx - r, cx + r + 1):
+            for j in range(cy - r, cy + r + 1):
+                bucket = self.cells.get((i, j))
+                if bucket:
+                    ids.update(bucket)
+        if not ids:
+            return float("inf")
+        d = float(_seg_dist(px, py, *self._segments(np.fromiter(ids, np.int64, len(ids)))).min())
+        return d if d <= radius else float("inf")
+
+
+def metrics(ego, is_leader, sig=(0, 0, 0, None)):
+    ctx = _context(ego)
+    M = ctx.m
+
+    M["steps"] += 1
+    ctx.sep.register(ego)
     x, y, _ = _pose(ego)
-    field = _get_field(ego)
+    field = _get_field(ctx, ego)
 
     # leader-follower distance 
     if not is_leader:
-        lx , ly, _= _LEADER_POSE
-        _M["sum_dist_to_leader"] += math.hypot(x - lx, y - ly)
-        _M["sum_inter_member_dist"] += _average_sep_from_peers(ego)
-        _M["pheromone_sum"] += field.val_at(x,y)
-        _M["follower_count"] += 1
+        team, _, follow, _ = sig
+        lp = ctx.leaders.get(team)      # None until the team's leader has acted, or if it has none
+        if lp is not None:
+            M["sum_dist_to_leader"] += math.hypot(x - lp[0], y - lp[1])
+            M["leader_samples"] += 1
+        mean_sep, min_sep = ctx.sep.stats(ego)
+        M["sum_inter_member_dist"] += mean_sep
+        if math.isfinite(min_sep):
+            M["sum_min_sep"] += min_sep
+            M["min_sep_samples"] += 1
+        M["pheromone_sum"] += field.val_at(x, y, follow, ctx.deposits)
+        M["follower_count"] += 1
         #whether follower is on the path
-        if len(_LEAD_PATH) >= 1:
-            d_path = _min_dist_to_polyline(x, y, _LEAD_PATH)
-            _M["follower_samples"] += 1
+        path = ctx.lead_paths.get(team)
+        if path is not None and len(path) >= 1:
+            d_path = path.dist(x, y, PATH_BAND)
+            M["follower_samples"] += 1
             if d_path <= PATH_BAND:
-                _M["onpath_hits"] += 1
+                M["onpath_hits"] += 1
  
 
-def metrics_report():
-    steps = max(_M["steps"], 1)
+def metrics_report(env=None):
+    """
+    Metrics of `env`, default the environment that ran last.
+    """
+    M = (_LAST[0] if env is None else _env_context(env)).m
+    steps = max(M["steps"], 1)
     report = {
-        "mean_dist_to_leader": _M["sum_dist_to_leader"] / max(_M["follower_count"], 1),
-        "mean_inter_member_dist": _M["sum_inter_member_dist"] / max(_M["follower_count"], 1),
-        "follower_onpath_ratio": _M["onpath_hits"] / max(_M["follower_samples"], 1),
-        "mean_pheromone_conc": _M["pheromone_sum"] / max(_M["follower_count"], 1),
+        "mean_dist_to_leader": M["sum_dist_to_leader"] / max(M["leader_samples"], 1),
+        "mean_inter_member_dist": M["sum_inter_member_dist"] / max(M["follower_count"], 1),
+        "mean_min_sep": M["sum_min_sep"] / max(M["min_sep_samples"], 1),
+        "follower_onpath_ratio": M["onpath_hits"] / max(M["follower_samples"], 1),
+        "mean_pheromone_conc": M["pheromone_sum"] / max(M["follower_count"], 1),
         "steps": steps,
     }
 
@@ -306,7 +824,8 @@ def metrics_report():
 # Followers sample headings by combining pheromone τ and heuristic η 
 @register_behavior("diff", "aco_follow_line")
 def beh_diff_aco_follow(ego_object, objects=None, *args, **kwargs):
-    field = _get_field(ego_object)
+    ctx = _context(ego_object)
+    field = _get_field(ctx, ego_object)
     x, y, th = _pose(ego_object)
     is_leader = _is_leader(ego_object, kwargs)
     V_MAX_STEP, W_MAX_STEP = _agent_limits(ego_object)
@@ -315,22 +834,29 @@ def beh_diff_aco_follow(ego_object, objects=None, *args, **kwargs):
     if "role" in kwargs and isinstance(kwargs["role"], str):
         if getattr(ego_object, "role", None) != kwargs["role"]:
             ego_object.role = kwargs["role"]
+    sig = _signals(field, ego_object, kwargs)
 
-    # Pheromone update (single step-owner advances the field dynamics)
-    if getattr(ego_object, "id", None) == _STEP_OWNER:
+    # Pheromone update (single step-owner lays the pending deposits and advances the field dynamics)
+    if getattr(ego_object, "id", None) == ctx.step_owner:
+        _flush_deposits(ctx, field)
         field.step()
-    field.deposit(x, y, PH_DEP_L if is_leader else PH_DEP_F)
+        if PH_RECORD and field.tick % PH_RECORD_EVERY == 0:
+            _record(ctx, ego_object, field)
+    for q, val in zip(ctx.deposits, (x, y, PH_DEP_L if is_leader else PH_DEP_F, sig[1])):
+        q.append(val)
 
     # Desired motion
-    global _LEADER_POSE
     if is_leader:
-        _LEADER_POSE = (x, y, th)
+        ctx.leaders[sig[0]] = (x, y, th)
+        if sig[0] not in ctx.lead_paths:
+            ctx.lead_paths[sig[0]] = _PathIndex()
+        ctx.lead_paths[sig[0]].append(x, y)
         v, w = _waypoint_ve1(ego_object, x, y, th, V_MAX_STEP ,W_MAX_STEP)
         # v, w =_circle_vel(x, y, th, V_MAX_STEP, W_MAX_STEP , (5,5) , 3)
         v, w = _collision_avoidance_vel(ego_object, v ,w, W_MAX_STEP)
         return _shape_like_ref([v, w], getattr(ego_object, "vel_min", None))
     
-    hdg = _sample_heading_by_tau_eta(field, ego_object, objects, x, y, th)
+    hdg = _sample_heading_by_tau_eta(ctx, field, ego_object, objects, x, y, th, sig)
     vx, vy = math.cos(hdg), math.sin(hdg)
 
     # Convert desired vector to (v, w) with turn-aware speed scheduling
@@ -344,6 +870,6 @@ def beh_diff_aco_follow(ego_object, objects=None, *args, **kwargs):
     w = np.clip(w, -W_MAX_STEP, W_MAX_STEP)
 
     # evaluate
-    metrics(ego_object, is_leader)
+    metrics(ego_object, is_leader, sig)
 
     return _shape_like_ref([v, w], getattr(ego_object, "vel_min", None))
@@ -2,23 +2,24 @@ from __future__ import annotations
 import math
 import weakref
 import time
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field
 from typing import Dict, List, Tuple, Optional, Set
 import numpy as np
 from irsim.lib import register_behavior
 from movement_style import _waypoint_ve1,_circle_vel
 from collision_avoidance import _collision_avoidance_vel
+from separation import PeerSeparation
 
 # -------- parameters--------
 COMM_TTL = 1.5                                # seconds messages stay valid
 HEARTBEAT_DT = 0.7                            # leader heartbeat period
 ELECTION_TIMEOUT = 1.0                        # time to wait for victory
-AUCTION_ENABLED = False
+AUCTION_ENABLED = False                       # initial value; switched on per environment once a leader pose is heard
 EPS = 1e-6                                     # avoid div-by-zero in bids
 CIRCLE_CENTER = (10.0, 10.0)
 CIRCLE_RADIUS = 6.0
 Side = "right"
-_last_election_started_at: Optional[float] = None
 
 # -------- message type--------
 ELECTION = "election"
@@ -30,11 +31,6 @@ AUC_REQ = "auc_req"       # leader -> followers: {"slots":[...]}
 BID = "bid"               # follower -> leader: {"slot":int, "price":float}
 ASSIGN = "assign"         # leader -> all: {"slot":int, "winner":int, "price":float}
 
-# ---- leader-side auction book-keeping ----
-_LEADER_CURRENT: Optional[int] = None        
-_ASSIGNED_SLOTS: Dict[int, int] = {}          # slot -> follower id
-_ASSIGNED_FOLLOWERS: Set[int] = set()         # followers already assigned
-
 # ==== shared bus for communication ====
 
 class _Bus:
@@ -56,13 +52,11 @@ class _Bus:
         self.msgs = [m for m in self.msgs if (now - m.get("t", now)) <= ttl]    # Drop expired message by ttl
         return [m for m in self.msgs if m.get("dst") in (None, dst)]
 
-BUS = _Bus()
-
-def _broadcast(src: int, typ: str, data: dict):
-    BUS.send({"type": typ, "src": src, "dst": None, "data": data, "t": BUS.now()})
+def _broadcast(ctx: _Context, src: int, typ: str, data: dict):
+    ctx.bus.send({"type": typ, "src": src, "dst": None, "data": data, "t": ctx.bus.now()})
 
-def _unicast(src: int, dst: int, typ: str, data: dict):
-    BUS.send({"type": typ, "src": src, "dst": dst, "data": data, "t": BUS.now()})
+def _unicast(ctx: _Context, src: int, dst: int, typ: str, data: dict):
+    ctx.bus.send({"type": typ, "src": src, "dst": dst, "data": data, "t": ctx.bus.now()})
 
 
 # ==== tools for irsim ====
@@ -103,32 +97,77 @@ class AgentState:
     last_heartbeat_s: float = 0.0
     slot_id: Optional[int] = None
 
-_STATES: Dict[int, AgentState] = {}
-
+# ==== State per environment ====
 
-def _st(ego) -> AgentState:
+@dataclass
+class _Context:
+    bus: _Bus = field(default_factory=_Bus)
+    states: Dict[int, AgentState] = field(default_factory=dict)
+    sep: PeerSeparation = field(default_factory=PeerSeparation)   # robots seen by metrics(), separations per tick
+    auction_enabled: bool = field(default_factory=lambda: AUCTION_ENABLED)
+    speed: float = 0.0                                # leader speed, followers track it
+    last_election_started_at: Optional[float] = None
+    # leader-side auction book-keeping
+    leader_current: Optional[int] = None
+    assigned_slots: Dict[int, int] = field(default_factory=dict)   # slot -> follower id
+    assigned_followers: Set[int] = field(default_factory=set)      # followers already assigned
+    m: dict = field(default_factory=lambda: {
+        "steps": 0,
+        "sum_dist_to_leader": 0.0,
+        "sum_inter_member_dist": 0.0,
+        "sum_pos_err": 0.0,
+        "follower_count": 0,
+        "sum_min_sep": 0.0,
+        "min_sep_samples": 0,
+        "sum_election_time": 0.0,
+        "election_count": 0,
+    })
+
+_CTX = weakref.WeakKeyDictionary()      # irsim environment -> _Context, dropped with the environment
+_CTX_LOCK = threading.Lock()
+_DEFAULT = _Context()                   # robots without an environment
+_LAST = [_DEFAULT]                      # context of the latest call, reported by metrics_report()
+
+
+def _env_context(env) -> _Context:
+    if env is None:
+        return _DEFAULT
+    ctx = _CTX.get(env)
+    if ctx is None:
+        with _CTX_LOCK:
+            ctx = _CTX.get(env)
+            if ctx is None:
+                ctx = _CTX[env] = _Context()
+    return ctx
+
+
+def _context(ego) -> _Context:
+    ctx = _LAST[0] = _env_context(getattr(ego, "_env", None))
+    return ctx
+
+
+def _st(ctx: _Context, ego) -> AgentState:
     k = id(ego)
-    if k not in _STATES:
-        _STATES[k] = AgentState()
-    return _STATES[k]
+    if k not in ctx.states:
+        ctx.states[k] = AgentState()
+    return ctx.states[k]
 
 # ==== Bully algorithm for leader election ====
 
-def _begin_election(aid: int, state: AgentState, higher_ids: List[int], election_timeout: float):
-    global _last_election_started_at
+def _begin_election(ctx: _Context, aid: int, state: AgentState, higher_ids: List[int], election_timeout: float):
     state.election_mode = True
     state.leader_id = None
-    state.waiting_victory_until = BUS.now() + election_timeout
-    _last_election_started_at = BUS.now()
+    state.waiting_victory_until = ctx.bus.now() + election_timeout
+    ctx.last_election_started_at = ctx.bus.now()
     for hid in higher_ids:
-        _unicast(aid, hid, ELECTION, {})
+        _unicast(ctx, aid, hid, ELECTION, {})
 
 
-def _handle_bully(ego, N: int, comm_ttl: float, election_timeout: float, heartbeat_dt: float):
+def _handle_bully(ctx: _Context, ego, N: int, comm_ttl: float, election_timeout: float, heartbeat_dt: float):
     # Get id,state,time
     aid = _robot_id(ego)
-    st = _st(ego)
-    now = BUS.now()
+    st = _st(ctx, ego)
+    now = ctx.bus.now()
 
     # Detect leader loss via heartbeat
     if st.leader_id is not None and aid != st.leader_id:
@@ -138,19 +177,19 @@ def _handle_bully(ego, N: int, comm_ttl: float, election_timeout: float, heartbe
     # If no leader known and not already in election -> start one
     if st.leader_id is None and not st.election_mode:
         higher = [i for i in range(N) if i > aid]
-        _begin_election(aid, st, higher, election_timeout)
+        _begin_election(ctx, aid, st, higher, election_timeout)
 
     # Receive messages destined for me (or broadcast)
-    inbox = BUS.recv(aid, ttl=comm_ttl)
+    inbox = ctx.bus.recv(aid, ttl=comm_ttl)
     for m in inbox:
         typ, src = m["type"], m["src"]
         if typ == ELECTION:
             if src < aid:
                 # If from lower ID : answer and start my own election
-                _unicast(aid, src, ANSWER, {})
+                _unicast(ctx, aid, src, ANSWER, {})
                 if not st.election_mode:
                     higher = [i for i in range(N) if i > aid]
-                    _begin_election(aid, st, higher, election_timeout)
+                    _begin_election(ctx, aid, st, higher, election_timeout)
             # If from higher ID: do nothing (wait for victory)
 
         elif typ == ANSWER and st.election_mode:
@@ -168,33 +207,32 @@ def _handle_bully(ego, N: int, comm_ttl: float, election_timeout: float, heartbe
     if st.election_mode and now >= st.waiting_victory_until:
         st.election_mode = False
         st.leader_id = aid
-        _broadcast(aid, VICTORY, {})
+        _broadcast(ctx, aid, VICTORY, {})
 
     # Leader heartbeat
     if st.leader_id == aid:
         # Broadcast heartbeat to show the existence of leader
-        _broadcast(aid, HEARTBEAT, {})
+        _broadcast(ctx, aid, HEARTBEAT, {})
         st.last_heartbeat_s = now
 
     return st.leader_id
 
 # ==== First Price Sealed Bid(FPSB) Auctions algorithm for follower to decide slot id  ====
-def _reset_auction_state():
-    global _ASSIGNED_SLOTS, _ASSIGNED_FOLLOWERS
-    _ASSIGNED_SLOTS = {}
-    _ASSIGNED_FOLLOWERS = set()
+def _reset_auction_state(ctx: _Context):
+    ctx.assigned_slots = {}
+    ctx.assigned_followers = set()
 
-def _start_FPSB_auction(ego, N):
+def _start_FPSB_auction(ctx: _Context, ego, N):
     my_id = _robot_id(ego)
-    if AUCTION_ENABLED:
+    if ctx.auction_enabled:
         followers = [i for i in range(N) if i != my_id]
         total_slots = len(followers)
-        pending_slots = [s for s in range(1, total_slots + 1) if s not in _ASSIGNED_SLOTS]
+        pending_slots = [s for s in range(1, total_slots + 1) if s not in ctx.assigned_slots]
         if pending_slots:
             # ask for bids for all pending slots at once
-            _broadcast(my_id, AUC_REQ, {"slots": pending_slots})
+            _broadcast(ctx, my_id, AUC_REQ, {"slots": pending_slots})
             # collect bids currently on bus
-            inbox = BUS.recv(my_id, ttl=COMM_TTL)
+            inbox = ctx.bus.recv(my_id, ttl=COMM_TTL)
             bids_by_slot: Dict[int, List[Tuple[float,int]]] = {s: [] for s in pending_slots}
             for m in inbox:
                 if m.get("type") == BID and m.get("dst") in (None, my_id):
@@ -202,24 +240,24 @@ def _start_FPSB_auction(ego, N):
                     slot = int(d.get("slot", -1))
                     price = float(d.get("price", 0.0))
                     bidder = int(m.get("src", -1))
-                    if slot in bids_by_slot and bidder in followers and bidder not in _ASSIGNED_FOLLOWERS:
+                    if slot in bids_by_slot and bidder in followers and bidder not in ctx.assigned_followers:
                         bids_by_slot[slot].append((price, bidder))
                 # sequentially assign slots to highest bidders; winners don't participate further
             for slot in sorted(pending_slots):
                 # remove bidders that already won a previous slot in this same pass
-                opts = [t for t in bids_by_slot.get(slot, []) if t[1] not in _ASSIGNED_FOLLOWERS]
+                opts = [t for t in bids_by_slot.get(slot, []) if t[1] not in ctx.assigned_followers]
                 if not opts:
                     continue
                 price, winner = max(opts, key=lambda t: (t[0], -t[1]))  # tie-break by smaller id
-                _ASSIGNED_SLOTS[slot] = winner
-                _ASSIGNED_FOLLOWERS.add(winner)
-                _broadcast(my_id, ASSIGN, {"slot": slot, "winner": winner, "price": price})
+                ctx.assigned_slots[slot] = winner
+                ctx.assigned_followers.add(winner)
+                _broadcast(ctx, my_id, ASSIGN, {"slot": slot, "winner": winner, "price": price})
     
-def _handle_auction(ego, lp, leader_id, x, y):
-    if AUCTION_ENABLED:
+def _handle_auction(ctx: _Context, ego, lp, leader_id, x, y):
+    if ctx.auction_enabled:
         my_id = _robot_id(ego)
-        st = _st(ego)
-        inbox = BUS.recv(my_id, ttl=COMM_TTL)
+        st = _st(ctx, ego)
+        inbox = ctx.bus.recv(my_id, ttl=COMM_TTL)
         for m in inbox:
             typ, src = m["type"], m["src"]
             if typ == AUC_REQ and st.slot_id is None and lp is not None:
@@ -230,7 +268,7 @@ def _handle_auction(ego, lp, leader_id, x, y):
                     gx, gy = v_anchor_xy(lp, side, rank)
                     dist = math.hypot(gx - x, gy - y)
                     price = 1.0 / (dist + EPS)   
-                    _unicast(my_id, leader_id, BID, {"slot": int(s), "price": float(price)})
+                    _unicast(ctx, my_id, leader_id, BID, {"slot": int(s), "price": float(price)})
 
             elif typ == ASSIGN:
                 d = m.get("data", {})
@@ -267,9 +305,9 @@ def v_anchor_xy(leader_xyh, side = Side, rank=1, spacing = 0.5,angle_deg = 45.0,
     return (x, y)
 
 
-def _read_leader_pose_from_bus(my_id: int, leader_id: int, comm_ttl: float) -> Optional[Tuple[float, float, float]]:
+def _read_leader_pose_from_bus(ctx: _Context, my_id: int, leader_id: int, comm_ttl: float) -> Optional[Tuple[float, float, float]]:
 
-    inbox = BUS.recv(my_id, ttl=comm_ttl)
+    inbox = ctx.bus.recv(my_id, ttl=comm_ttl)
     latest = None
     t_latest = -1.0
     for m in inbox:
@@ -293,70 +331,43 @@ def _ctrl_to_point(x, y, th, xt, yt, speed: float) -> Tuple[float, float]:
     return v, w 
 
 # ==== Evaluation ====
-_M = {
-    "steps": 0,
-    "sum_dist_to_leader": 0.0,
-    "sum_inter_member_dist": 0.0,
-    "sum_pos_err": 0.0,
-    "follower_count": 0,
-    "sum_election_time": 0.0,
-    "election_count": 0,
-}
-
-_PEERS = []
-
-def _register_peer(ego):
-    for w in _PEERS:
-        if w() is ego:
-            return
-    _PEERS.append(weakref.ref(ego))
-
-def _average_sep_from_peers(ego):
-    count = 1
-    sum_sep = 0
-    if not hasattr(ego, "state"):
-        return None
-    ex, ey = float(ego.state[0]), float(ego.state[1])
-    for w in _PEERS:
-        other = w()
-        if (other is None) or (other is ego) or (not hasattr(other, "state")):
-            continue
-        ox, oy = float(other.state[0]), float(other.state[1])
-        d = np.hypot(ox - ex, oy - ey)
-        sum_sep += d
-        count +=1
-    return sum_sep/count
-
-def metrics(ego, leader_id, lp, gx, gy):
-    global _M, _PEERS,_last_election_started_at
-
-    _M["steps"] += 1
-    _register_peer(ego)
+def metrics(ctx: _Context, ego, leader_id, lp, gx, gy):
+    M = ctx.m
+
+    M["steps"] += 1
+    ctx.sep.register(ego)
     my_id = _robot_id(ego)
     x, y, _ = _pose(ego)
 
     # election duration
-    if _last_election_started_at is not None and leader_id is not None:
-        _M["sum_election_time"] += BUS.now() - _last_election_started_at
-        _M["election_count"] += 1
-        _last_election_started_at = None 
+    if ctx.last_election_started_at is not None and leader_id is not None:
+        M["sum_election_time"] += ctx.bus.now() - ctx.last_election_started_at
+        M["election_count"] += 1
+        ctx.last_election_started_at = None 
 
     # leader-follower distance & position error
     if my_id  != leader_id and lp is not None:
         lx , ly, _= lp
-        _M["sum_dist_to_leader"] += math.hypot(x - lx, y - ly)
-        _M["sum_pos_err"] += math.hypot(x - gx, y - gy)
-        _M["sum_inter_member_dist"] += _average_sep_from_peers(ego)
-        _M["follower_count"] += 1
+        M["sum_dist_to_leader"] += math.hypot(x - lx, y - ly)
+        M["sum_pos_err"] += math.hypot(x - gx, y - gy)
+        mean_sep, min_sep = ctx.sep.stats(ego)
+        M["sum_inter_member_dist"] += mean_sep
+        if math.isfinite(min_sep):
+            M["sum_min_sep"] += min_sep
+            M["min_sep_samples"] += 1
+        M["follower_count"] += 1
  
 
-def metrics_report():
-    steps = max(_M["steps"], 1)
+def metrics_report(env=None):
+    # env: the irsim environment to report on, default the one that ran last
+    M = (_LAST[0] if env is None else _env_context(env)).m
+    steps = max(M["steps"], 1)
     report = {
-        "mean_dist_to_leader": _M["sum_dist_to_leader"] / max(_M["follower_count"], 1),
-        "mean_inter_member_dist": _M["sum_inter_member_dist"] / max(_M["follower_count"], 1),
-        "avg_election_time": _M["sum_election_time"] / max(_M["election_count"], 1),
-        "mean_pos_error": _M["sum_pos_err"] / max(_M["follower_count"], 1),
+        "mean_dist_to_leader": M["sum_dist_to_leader"] / max(M["follower_count"], 1),
+        "mean_inter_member_dist": M["sum_inter_member_dist"] / max(M["follower_count"], 1),
+        "mean_min_sep": M["sum_min_sep"] / max(M["min_sep_samples"], 1),
+        "avg_election_time": M["sum_election_time"] / max(M["election_count"], 1),
+        "mean_pos_error": M["sum_pos_err"] / max(M["follower_count"], 1),
         "steps": steps,
     }
 
@@ -366,15 +377,15 @@ def metrics_report():
 # ==== register behavior : bully fleet ====
 @register_behavior("diff", "bully_fleet")
 def beh_diff_bully_fleet(ego_object, objects=None, *args, **kwargs):
-    global _LEADER_CURRENT, SPEED ,AUCTION_ENABLED
+    ctx = _context(ego_object)
     N = int(kwargs.get("N", 5))
     my_id = _robot_id(ego_object)
     x, y, th = _pose(ego_object)
-    st = _st(ego_object)
+    st = _st(ctx, ego_object)
     V_MAX, W_MAX = _agent_limits(ego_object)
 
     # 1) Run bully election
-    leader_id = _handle_bully(ego_object, N, COMM_TTL, ELECTION_TIMEOUT, HEARTBEAT_DT)    
+    leader_id = _handle_bully(ctx, ego_object, N, COMM_TTL, ELECTION_TIMEOUT, HEARTBEAT_DT)    
     if my_id == leader_id:
         ego_object.color = "brown"
         ego_object.traj_color = "brown" 
@@ -383,44 +394,44 @@ def beh_diff_bully_fleet(ego_object, objects=None, *args, **kwargs):
         ego_object.traj_color = "green"  
     
     # 2) Detect leader change to reset auction state
-    if leader_id != _LEADER_CURRENT :
-        _LEADER_CURRENT = leader_id
-        _reset_auction_state()
+    if leader_id != ctx.leader_current :
+        ctx.leader_current = leader_id
+        _reset_auction_state(ctx)
         st.slot_id = None
 
     if my_id == leader_id:
         # 3) announce pose
-        _broadcast(my_id, POSE, {"x": x, "y": y, "th": th})
+        _broadcast(ctx, my_id, POSE, {"x": x, "y": y, "th": th})
 
         # 4) start auction
-        _start_FPSB_auction(ego_object, N)
+        _start_FPSB_auction(ctx, ego_object, N)
 
         # 5) calculate leader v,w considering collision avoidance
         # v, w = _waypoint_ve1(ego_object,x, y, th, V_MAX_STEP, W_MAX_STEP)
         v, w =_circle_vel(x, y, th, V_MAX, W_MAX , CIRCLE_CENTER , CIRCLE_RADIUS)
         v, w = _collision_avoidance_vel(ego_object, v ,w, W_MAX)
-        SPEED = abs(v)                                                    # control follower v
+        ctx.speed = abs(v)                                                  # control follower v
         return _shape_like_ref([v, w], getattr(ego_object, "vel_min", None))
 
 
     # 6) read leader pose
-    lp = _read_leader_pose_from_bus(my_id, leader_id, COMM_TTL)
+    lp = _read_leader_pose_from_bus(ctx, my_id, leader_id, COMM_TTL)
 
     # 7) handle auction to get the slot of follower
-    st.slot_id = _handle_auction(ego_object, lp, leader_id ,x, y)
+    st.slot_id = _handle_auction(ctx, ego_object, lp, leader_id ,x, y)
 
     if lp is not None :
-        AUCTION_ENABLED = True
+        ctx.auction_enabled = True
 
     # 8) calculate follower v,w considering collision avoidance
     if st.slot_id is None or lp is None:
         v, w = 0.1, 0.1
-        metrics(ego_object, leader_id, lp, x, y)     # evaluate
+        metrics(ctx, ego_object, leader_id, lp, x, y)     # evaluate
     else:
         side, rank = idx_to_side_rank(st.slot_id)
         gx, gy = v_anchor_xy(lp, side, rank)
-        v, w = _ctrl_to_point(x, y, th, gx, gy, SPEED)
-        metrics(ego_object, leader_id, lp, gx, gy)    # evaluate
+        v, w = _ctrl_to_point(x, y, th, gx, gy, ctx.speed)
+        metrics(ctx, ego_object, leader_id, lp, gx, gy)    # evaluate
     v, w = _collision_avoidance_vel(ego_object, v, w, W_MAX)
 
     return _shape_like_ref([v, w], getattr(ego_object, "vel_min", None))
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+Ring recording of the ACO pheromone field and robot poses in one preallocated np.memmap file.
+
+    python run_headless.py a2-aco --set "PH_RECORD='aco.rec'" --set "PH_RECORD_EVERY=5"
+    rec = Recording("assignment2/aco.rec")
+    rec.field(-1)                   # latest frame (channels, ny, nx), a view into the file
+    rec.heatmap("trail")            # mean intensity over the recorded frames
+    rec.poses[:, rec.leaders()]     # leader path
+
+Layout: a HEADER-byte header (magic, frames written, JSON metadata), then `slots` fixed-size frames
+(tick, poses (robots, 3), field (channels, H, W) padded to whole tiles); frame k lives in slot k % slots.
+When a channel or a robot is added the file is rewritten with the new layout; in the frames before,
+the new channels read 0 and the new robots' poses NaN.
+"""
+import json
+import os
+import weakref
+
+import numpy as np
+
+MAGIC = b"PHREC001"
+HEADER = 4096
+
+
+def _frame_dtype(meta):
+    C, R = len(meta["channels"]), len(meta["robot_ids"])
+    H, W = meta["padded"]
+    return np.dtype([("tick", "<i8"), ("poses", "<f4", (R, 3)), ("field", "<f4", (C, H, W))])
+
+
+def _flush(frames, count):
+    frames.flush()
+    count.flush()                       # last: a reader never counts a frame that is not on disk
+
+
+class FieldRecorder:
+    """
+    Writer side. record() fills the next slot: the field is scattered from its tiles straight into the
+    file, the poses are one (robots, 3) copy, and the frame counter is bumped last. The file is flushed
+    by close(), or when the recorder is dropped or the interpreter exits.
+    """
+
+    def __init__(self, path, field, robot_ids, roles, slots):
+        self.path, self.slots = path, int(slots)
+        self._create(field, robot_ids, roles)
+
+    def _create(self, field, robot_ids, roles):
+        meta = {"slots": self.slots, "robot_ids": [int(r) for r in robot_ids], "roles": list(roles),
+                "channels": [str(c) for c in field.names], "shape": [field.ny, field.nx],
+                "padded": [field.nty * field.T, field.ntx * field.T],
+                "bounds": list(field.bounds), "cell": field.cell}
+        text = json.dumps(meta).encode()
+        if 24 + len(text) > HEADER:
+            raise ValueError("recording metadata does not fit in the header")
+        dtype = _frame_dtype(meta)
+        with open(self.path, "wb") as f:
+            f.write(MAGIC + np.int64(0).tobytes() + np.int64(len(text)).tobytes() + text)
+            f.truncate(HEADER + self.slots * dtype.itemsize)
+        self.meta = meta
+        self.count = np.memmap(self.path, "<i8", "r+", offset=len(MAGIC), shape=(1,))
+        self.frames = np.memmap(self.path, dtype, "r+", offset=HEADER, shape=(self.slots,))
+        self._final = weakref.finalize(self, _flush, self.frames, self.count)
+
+    def matches(self, field, robot_ids):
+        """True if frames of `field` and these robots fit the file as laid out."""
+        return (self.meta["channels"] == [str(c) for c in field.names]
+                and self.meta["robot_ids"] == [int(r) for r in robot_ids])
+
+    def reshape(self, field, robot_ids, roles):
+        """
+        Rewrite the file for the field's current channels and these robots, keeping the frames so far.
+        Channels and robots are matched by name and id; new ones read 0 and NaN in the older frames.
+        """
+        old_meta, count = self.meta, int(self.count[0])
+        self.close()
+        del self.frames, self.count
+        old_path = self.path + ".old"
+        os.replace(self.path, old_path)
+        try:
+            old = np.memmap(old_path, _frame_dtype(old_meta), "r", offset=HEADER, shape=(self.slots,))
+            self._create(field, robot_ids, roles)
+            ch = [(self.meta["channels"].index(c), i) for i, c in enumerate(old_meta["channels"])
+                  if c in self.meta["channels"]]
+            rows = {r: i for i, r in enumerate(old_meta["robot_ids"])}
+            keep = [(j, rows[r]) for j, r in enumerate(self.meta["robot_ids"]) if r in rows]
+            new_r, old_r = [j for j, _ in keep], [i for _, i in keep]
+            for k in range(min(count, self.slots)):       # one frame at a time: the ring may not fit in memory
+                self.frames["tick"][k] = old["tick"][k]
+                poses = np.full(self.frames["poses"].shape[1:], np.nan, np.float32)
+                poses[new_r] = old["poses"][k][old_r]
+                self.frames["poses"][k] = poses
+                for j, i in ch:
+                    self.frames["field"][k, j] = old["field"][k, i]
+            self.count[0] = count
+            del old
+        finally:
+            os.remove(old_path)
+
+    def record(self, tick, poses, field):
+        if len(field.names) != len(self.meta["channels"]):
+            raise ValueError(f"{self.path}: the recording holds {len(self.meta['channels'])} channels but the "
+                             f"field has {len(field.names)}; reshape() the recorder first")
+        k = int(self.count[0]) % self.slots
+        self.frames["tick"][k] = tick
+        self.frames["poses"][k] = poses
+        field.dense_into(self.frames["field"][k])
+        self.count[0] += 1
+
+    def close(self):
+        self._final()
+
+
+class Recording:
+    """
+    Reader side: the frames of a recording, oldest first, opened read-only without copying the field.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            head = f.read(HEADER)
+        if head[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a field recording")
+        count = int(np.frombuffer(head, "<i8", 1, len(MAGIC))[0])
+        size = int(np.frombuffer(head, "<i8", 1, len(MAGIC) + 8)[0])
+        self.meta = json.loads(head[len(MAGIC) + 16:len(MAGIC) + 16 + size])
+        slots = self.meta["slots"]
+        self.frames = np.memmap(path, _frame_dtype(self.meta), "r", offset=HEADER, shape=(slots,))
+        self.order = np.arange(max(0, count - slots), count) % slots     # slot of each frame, oldest first
+
+    def __len__(self):
+        return len(self.order)
+
+    @property
+    def ticks(self):
+        return self.frames["tick"][self.order]
+
+    @property
+    def poses(self):
+        """(frames, robots, 3) x, y, theta."""
+        return self.frames["poses"][self.order]
+
+    def leaders(self):
+        """Robot columns of the leaders."""
+        return [i for i, r in enumerate(self.meta["roles"]) if r == "leader"]
+
+    def field(self, i, channel=None):
+        """Frame i (negative from the newest): (channels, ny, nx), or (ny, nx) for one channel name or index."""
+        ny, nx = self.meta["shape"]
+        g = self.frames["field"][self.order[i]][:, :ny, :nx]
+        return g if channel is None else g[self._channel(channel)]
+
+    def heatmap(self, channel=0):
+        """Mean (ny, nx) intensity of one channel over all frames, read a frame at a time."""
+        ny, nx = self.meta["shape"]
+        c = self._channel(channel)
+        acc = np.zeros((ny, nx))
+        for k in self.order:
+            acc += self.frames["field"][k, c, :ny, :nx]
+        return acc / max(len(self.order), 1)
+
+    def _channel(self, channel):
+        return self.meta["channels"].index(channel) if isinstance(channel, str) else channel
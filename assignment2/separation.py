@@ -0,0 +1,63 @@
+import weakref
+
+import numpy as np
+
+# -------- Pairwise separation parameters --------
+SEP_CHUNK = 1024                # Rows of the pairwise distance matrix computed at a time
+
+
+def _tick(ego):
+    # irsim's step counter, the cache key; None outside an environment (recomputed every query then)
+    world = getattr(getattr(ego, "_env", None), "_world", None)
+    return getattr(world, "count", None)
+
+
+# -------- Separation of registered robots, once per tick --------
+class PeerSeparation:
+    """
+    Robots registered by the metrics and, once per tick, a snapshot of their positions with each one's
+    mean and minimum distance to the others. The first query of a tick computes it, later ones read it.
+    """
+
+    def __init__(self):
+        self.refs = []                          # weak references, in registration order
+        self._known = weakref.WeakSet()
+        self.tick = None
+        self.rows = weakref.WeakKeyDictionary()  # robot -> row of the snapshot
+        self.mean = np.zeros(0)
+        self.min = np.zeros(0)
+
+    def register(self, ego):
+        if ego not in self._known:
+            self._known.add(ego)
+            self.refs.append(weakref.ref(ego))
+
+    def _snapshot(self, tick):
+        self.refs = [w for w in self.refs if w() is not None]
+        robots = [o for o in (w() for w in self.refs) if hasattr(o, "state")]
+        xy = np.array([np.ravel(o.state)[:2] for o in robots], float).reshape(-1, 2)
+        n = len(xy)
+        self.tick = tick
+        self.rows = weakref.WeakKeyDictionary((o, i) for i, o in enumerate(robots))
+        self.mean = np.zeros(n)
+        self.min = np.full(n, np.inf)
+        for i0 in range(0, n, SEP_CHUNK):       # (chunk, n) block of the distance matrix at a time
+            blk = xy[i0:i0 + SEP_CHUNK]
+            d = np.hypot(blk[:, None, 0] - xy[None, :, 0], blk[:, None, 1] - xy[None, :, 1])
+            rows = np.arange(len(blk))
+            self.mean[i0:i0 + len(blk)] = d.sum(axis=1) / n     # the robot itself counts as distance 0
+            d[rows, i0 + rows] = np.inf
+            self.min[i0:i0 + len(blk)] = d.min(axis=1)
+
+    def stats(self, ego):
+        """
+        (mean, min) distance from ego to the registered robots at the current tick, or None if ego
+        has no position. The mean is over all of them including ego; min is inf when ego is alone.
+        """
+        tick = _tick(ego)
+        if tick is None or tick != self.tick or ego not in self.rows:
+            self._snapshot(tick)
+        i = self.rows.get(ego)
+        if i is None:
+            return None
+        return float(self.mean[i]), float(self.min[i])
@@ -239,7 +239,7 @@ def run_all_plots(agent_data, outdir_mean_std, outdir_top5):
 
 
 def main():
-    files = sorted(glob.glob("rm_metrics_agent_*.csv"))
+    files = sorted(glob.glob("rm_metrics_*agent_*.csv"))
 
     agent_data = {}
     for f in files:
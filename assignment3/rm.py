@@ -2,6 +2,9 @@ import math
 import random
 import csv
 import os
+import itertools
+import threading
+import weakref
 import numpy as np
 from collections import defaultdict
 from irsim.lib import register_behavior
@@ -12,6 +15,7 @@ from collision_avoidance import _collision_avoidance_vel
 GRID_SIZE = 0.5                 # meters per cell
 COLLECT_RADIUS = 0.3            # radius to collect reward patch
 STEP_PENALTY = 0.01             # living cost per step
+EPS = 0.10                      # exploration probability
 REWARD_PATCHES = [              # Predefined reward “patches” (center_x, center_y, reward_value)
     ( 1.0,  1.0,  5.0),
     ( 2.0,  2.0,  3.0),
@@ -39,7 +43,21 @@ ACTIONS = [                 # Action set: (v, w) pairs
     (0.00, -1.8),           # rotate right
 ]
 NA=len(ACTIONS)
-RM_MEMORY = {}              # Global RM memory 
+RM_CSV = "rm_metrics_{env}_agent_{rid}.csv"   # per-agent metrics file; {env} keeps the environments of one process apart
+
+
+class _Memory(dict):
+    """Robot id -> RM memory of one environment; `csv_tag` fills {env} in RM_CSV."""
+
+    def __init__(self, csv_tag):
+        super().__init__()
+        self.csv_tag = csv_tag
+
+
+RM_MEMORY = _Memory("noenv")    # RM memory of robots outside an irsim environment
+_ENV_MEMORY = weakref.WeakKeyDictionary()   # irsim environment -> its own RM memory, dropped with the environment
+_ENV_SEQ = itertools.count(1)   # numbers the environments in the order they first step
+_ENV_LOCK = threading.Lock()
 
 # -------------------- Helper functions --------------------
 def _pose(ego):
@@ -65,18 +83,32 @@ def _agent_limits(ego):
         vmax, wmax = 1.0, 1.2
     return vmax, wmax
 
+def rm_memory(env=None):
+    """Robot id -> RM memory for the robots of `env` (RM_MEMORY when env is None)."""
+    if env is None:
+        return RM_MEMORY
+    memory = _ENV_MEMORY.get(env)
+    if memory is None:
+        with _ENV_LOCK:
+            memory = _ENV_MEMORY.get(env)
+            if memory is None:
+                memory = _ENV_MEMORY[env] = _Memory(f"env{next(_ENV_SEQ)}")
+    return memory
+
 def get_mem(ego):
+    memory = rm_memory(getattr(ego, "_env", None))
     rid = getattr(ego, "id", None)
     rid = rid if rid is not None else id(ego)  
-    if rid not in RM_MEMORY:
-        RM_MEMORY[rid] = {
+    if rid not in memory:
+        memory[rid] = {
             "collected": set(),
             "N": defaultdict(lambda: [0] * NA),
             "sumR": defaultdict(lambda: [0.0] * NA),
             "regret": defaultdict(lambda: [0.0] * NA),
-            "last_sa": None
+            "last_sa": None,
+            "csv_path": RM_CSV.format(env=memory.csv_tag, rid=rid)
         }
-    return RM_MEMORY[rid]
+    return memory[rid]
 
 def reward_computation(ego_object, mem):
     x, y, th = _pose(ego_object)
@@ -125,7 +157,6 @@ def choose_new_action(ego_object, mem):
     x, y, th = _pose(ego_object)
     s = state_key_from_xy(x, y)
 
-    EPS = 0.10  # exploration probability
     if random.random() < EPS:
         a = random.randrange(NA)
         mem["last_sa"] = (s, a)
@@ -166,30 +197,23 @@ def _get_csv_writer(mem, ego):
     if "csv_writer" in mem:
         return mem["csv_writer"]
 
-    rid = getattr(ego, "id", None)
-    rid = rid if rid is not None else id(ego)
-
-    filename = f"rm_metrics_agent_{rid}.csv"
-    file_exists = os.path.isfile(filename)
-
-    f = open(filename, "a", newline="", encoding="utf-8")
+    # a new run starts its own file: "w" drops the rows of an earlier run under the same name
+    f = open(mem["csv_path"], "w", newline="", encoding="utf-8")
     writer = csv.writer(f)
-
-    if not file_exists:
-        writer.writerow([
-            "agent_id",
-            "t",
-            "x", "y",
-            "dmin",
-            "episode_return",
-            "ema_return",
-            "recent_mean",
-            "collected",
-            "since_last_collect",
-            "pos_regret_sum",
-            "regret_max",
-            "action_dist"
-        ])
+    writer.writerow([
+        "agent_id",
+        "t",
+        "x", "y",
+        "dmin",
+        "episode_return",
+        "ema_return",
+        "recent_mean",
+        "collected",
+        "since_last_collect",
+        "pos_regret_sum",
+        "regret_max",
+        "action_dist"
+    ])
 
     mem["csv_file"] = f
     mem["csv_writer"] = writer
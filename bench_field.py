@@ -0,0 +1,132 @@
+"""
+Throughput of the ACO pheromone field update against the original np.roll version, and of a
+small colony walking on a large field (time and tile memory against a dense grid), eager and lazy.
+
+    python bench_field.py
+    python bench_field.py --sizes 50 500 2000 --steps 200
+    python bench_field.py --sizes 500 --channels 1 4 8
+    python bench_field.py --colony 2000 --agents 20 --diff-every 1 10
+    python bench_field.py --colony 2000 --band --diff-every 1 10 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "assignment2"))
+
+import ACO  # noqa: E402
+
+
+def roll_step(g):
+    """The original _Field.step: four np.roll copies, toroidal edges."""
+    g *= ACO.PH_EVAP
+    if ACO.PH_DIFF > 0.0:
+        up = np.roll(g, -1, 0)
+        dn = np.roll(g, +1, 0)
+        lf = np.roll(g, -1, 1)
+        rt = np.roll(g, +1, 1)
+        g[:] = (1.0 - ACO.PH_DIFF) * g + ACO.PH_DIFF * 0.25 * (up + dn + lf + rt)
+
+
+def _time(step, steps):
+    step()                                   # warm-up
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        step()
+    return (time.perf_counter() - t0) / steps
+
+
+def bench(n, steps, channels=1, seed=0):
+    """
+    Seconds per step of both versions on an n x n grid, and the largest interior difference after one step.
+    The field carries `channels` channels (a trail per team); the speedup is against one np.roll step per channel.
+    """
+    rng = np.random.default_rng(seed)
+    g0 = rng.random((n, n), dtype=np.float32) * 50.0
+    names = ["trail"] + [f"trail:{k}" for k in range(1, channels)]
+    field = ACO._Field((0.0, n * 0.05, 0.0, n * 0.05), cell=0.05, channels=names)
+    ref = g0.copy()
+
+    # both versions agree away from the border
+    field.load(g0)
+    field.step()
+    roll_step(ref)
+    err = float(np.abs(field.snapshot(0)[1:-1, 1:-1] - ref[1:-1, 1:-1]).max())
+
+    ref[:] = g0
+    field.load(g0)
+    t_roll = _time(lambda: roll_step(ref), steps)
+    t_new = _time(field.step, steps)
+    return {"size": f"{n}x{n}", "channels": channels, "roll_ms": round(t_roll * 1e3, 4), "stencil_ms": round(t_new * 1e3, 4),
+            "speedup": round(t_roll * channels / t_new, 2), "cells_per_sec": f"{n * n * channels / t_new:.3g}",
+            "interior_max_diff": err}
+
+
+def bench_colony(n, agents, steps, lazy=False, diff_every=1, band=False, seed=0):
+    """
+    Seconds per tick of `agents` random walkers on an n x n field (1 cell per 0.05 m): one field step,
+    one batched deposit for all agents and N_DIR lookups per agent. With `band`, the field starts with an
+    old trail across the middle (80% of the width, 20% of the height), so most live tiles see no agent.
+    Returns (seconds per tick, tile pool bytes, final field).
+    """
+    rng = np.random.default_rng(seed)
+    side = n * 0.05
+    ACO.PH_DIFF_EVERY = diff_every
+    field = ACO._Field((0.0, side, 0.0, side), cell=0.05, lazy=lazy)
+    if band:
+        g = np.zeros((n, n), np.float32)
+        g[int(0.4 * n):int(0.6 * n), int(0.1 * n):int(0.9 * n)] = 1.0 + 5.0 * rng.random((int(0.6 * n) - int(0.4 * n),
+                                                                                          int(0.9 * n) - int(0.1 * n)))
+        field.load(g)
+    xy = np.full((agents, 2), side / 2) + rng.normal(0.0, 1.0, (agents, 2))
+    moves = rng.normal(0.0, 0.05, (steps, agents, 2))
+    angles = np.linspace(-np.pi, np.pi, ACO.N_DIR, endpoint=False)
+    t0 = time.perf_counter()
+    for k in range(steps):
+        field.step()
+        xy += moves[k]
+        field.deposit_many(xy[:, 0], xy[:, 1], ACO.PH_DEP_F)
+        for x, y in xy:
+            field.sample(x + ACO.LOOKAHEAD * np.cos(angles), y + ACO.LOOKAHEAD * np.sin(angles),
+                         ACO.PH_BILINEAR)
+    dt = (time.perf_counter() - t0) / steps
+    return dt, field.nbytes, field.snapshot(0)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark the pheromone field step.")
+    p.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 2000], help="grid side lengths")
+    p.add_argument("--steps", type=int, help="timed steps per size (default: scaled to the grid)")
+    p.add_argument("--channels", type=int, nargs="+", default=[1], help="field channels to step together")
+    p.add_argument("--colony", type=int, metavar="N", help="colony benchmark on an N x N field instead")
+    p.add_argument("--agents", type=int, default=20)
+    p.add_argument("--diff-every", type=int, nargs="+", default=[1, 10], help="lazy-mode diffusion cadences to try")
+    p.add_argument("--band", action="store_true", help="colony: start from an old trail band across the field")
+    args = p.parse_args(argv)
+    if args.colony:
+        steps = args.steps or 200
+        dense_mb = round(args.colony ** 2 * 4 / 2 ** 20, 2)
+        t_eager, nbytes, ref = bench_colony(args.colony, args.agents, steps, band=args.band)
+        print("[Colony]", {"size": f"{args.colony}x{args.colony}", "agents": args.agents, "mode": "eager",
+                           "ms_per_tick": round(t_eager * 1e3, 3), "tiles_mb": round(nbytes / 2 ** 20, 2),
+                           "dense_mb": dense_mb})
+        for k in args.diff_every:
+            dt, nbytes, g = bench_colony(args.colony, args.agents, steps, lazy=True, diff_every=k,
+                                         band=args.band)
+            print("[Colony]", {"size": f"{args.colony}x{args.colony}", "agents": args.agents,
+                               "mode": f"lazy, diffuse every {k}", "ms_per_tick": round(dt * 1e3, 3),
+                               "speedup": round(t_eager / dt, 2), "tiles_mb": round(nbytes / 2 ** 20, 2),
+                               "max_rel_diff": float(np.abs(g - ref).max() / max(ref.max(), 1e-12))})
+        return
+    for n in args.sizes:
+        steps = args.steps or max(5, int(2e7 // (n * n)))
+        for c in args.channels:
+            print("[Field]", bench(n, min(steps, 20000), c))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Headless scenario runner: no window, no render sleep.
+
+    python run_headless.py a1-basic --steps 500 --seed 0 --repeat 3
+    python run_headless.py a1-advanced --set "_ADP_MODE='active'" --set "_ADP_EVERY=100"
+    python run_headless.py --dir assignment2 --yaml test1.yaml --module ACO
+"""
+import argparse
+import ast
+import csv
+import importlib
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# -------------------- Scenarios --------------------
+SCENARIOS = {       # name -> (folder, world yaml, behavior module, default steps)
+    "a1-basic":    ("assignment1", "test1.yaml", "custom_behavior_methods_1", 500),
+    "a1-advanced": ("assignment1", "test2.yaml", "custom_behavior_methods_2", 500),
+    "a2-aco":      ("assignment2", "test1.yaml", "ACO", 500),
+    "a2-bully":    ("assignment2", "test_bully.yaml", "bully_FPSB", 500),
+    "a3-rm":       ("assignment3", "test.yaml", "rm", 5000),
+}
+METRIC_FUNCS = ("metrics_p", "metrics_report")     # whichever the behavior module defines
+
+
+def _forget_modules(folder):
+    # drop modules imported from `folder` and the irsim behaviors they registered, so the next import starts clean
+    from irsim.lib.behavior import behavior_registry as reg
+    names = set()
+    for name, mod in list(sys.modules.items()):
+        path = getattr(mod, "__file__", None)
+        if path and os.path.dirname(os.path.abspath(path)) == folder:
+            names.add(name)
+    for table in (reg.behaviors_map, reg.behaviors_class_map,
+                  reg.group_behaviors_map, reg.group_behaviors_class_map):
+        for key in [k for k, f in table.items() if getattr(f, "__module__", None) in names]:
+            del table[key]
+    for name in names:
+        del sys.modules[name]
+
+
+def _rm_csv_metrics(mod, env=None):
+    # rm.py has no report function: average the last row of the per-agent CSVs this environment wrote
+    memory = mod.rm_memory(env) if hasattr(mod, "rm_memory") else getattr(mod, "RM_MEMORY", {})
+    last = []
+    for rid in sorted(memory, key=str):
+        out = memory[rid].get("csv_file")
+        if out is None:
+            continue
+        out.flush()
+        with open(out.name, "r", encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+        if rows:
+            last.append(rows[-1])
+    if not last:
+        return None
+    keys = [k for k in last[0] if k not in ("agent_id", "action_dist")]
+    report = {k: float(np.mean([float(r[k]) for r in last])) for k in keys}
+    print(f"[RM CSV] mean over {len(last)} agents:", {k: round(v, 4) for k, v in report.items()})
+    return report
+
+
+def _derived_from(mod, names):
+    # top-level assignments of mod that read one of `names` at import time, directly or through an
+    # earlier such assignment, in source order (e.g. _S = BIN_D * BIN_TH); names set explicitly are left alone
+    tree = ast.parse(open(mod.__file__, "r", encoding="utf-8").read(), mod.__file__)
+    changed, out = set(names), []
+    for node in tree.body:
+        if not isinstance(node, (ast.Assign, ast.AnnAssign)) or node.value is None:
+            continue
+        reads = {n.id for n in ast.walk(node.value) if isinstance(n, ast.Name)}
+        targets = {n.id for t in (node.targets if isinstance(node, ast.Assign) else [node.target])
+                   for n in ast.walk(t) if isinstance(n, ast.Name)}
+        if reads & changed and not targets & set(names):
+            out.append(node)
+            changed |= targets
+    return out
+
+
+def _apply_settings(mod, settings):
+    for name, value in settings.items():
+        if not hasattr(mod, name):
+            raise AttributeError(f"{mod.__name__} has no setting {name!r}")
+        setattr(mod, name, value)
+    for node in _derived_from(mod, settings):      # recompute what the module derived from the old values
+        exec(compile(ast.Module([node], []), mod.__file__, "exec"), vars(mod))
+
+
+# -------------------- Runner --------------------
+def run_scenario(folder, yaml, module, steps, seed=None, settings=None, workdir=None):
+    """
+    One headless run of `module` on `yaml`, both relative to `folder`.
+    settings: module globals to override after import, e.g. {"_ADP_EVERY": 100}. Globals the module
+              computes from them at import time (BIN_D -> _S) are recomputed.
+    workdir: current directory during the run, where modules write their files (default `folder`).
+    Returns {"metrics": dict or None, "steps": int, "seconds": float, "steps_per_sec": float}.
+    """
+    import irsim
+
+    folder = os.path.abspath(folder)
+    workdir = os.path.abspath(workdir or folder)
+    cwd = os.getcwd()
+    os.chdir(workdir)                # CSV and other output lands in the working directory
+    sys.path.insert(0, folder)       # sibling imports (adp_tables, collision_avoidance, ...)
+    try:
+        _forget_modules(folder)
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+        env = irsim.make(os.path.join(folder, yaml), display=False)
+        env.load_behavior(module)
+        mod = importlib.import_module(module)
+        _apply_settings(mod, settings or {})
+
+        n = 0
+        t0 = time.perf_counter()
+        for _ in range(steps):
+            env.step()
+            n += 1
+            if env.done():
+                break
+        dt = time.perf_counter() - t0
+
+        metrics = None
+        for f in METRIC_FUNCS:
+            if hasattr(mod, f):
+                metrics = getattr(mod, f)(env=env)
+        if metrics is None:
+            metrics = _rm_csv_metrics(mod, env)
+        env.end(0)
+    finally:
+        sys.path.remove(folder)
+        os.chdir(cwd)
+    return {"metrics": metrics, "steps": n, "seconds": dt, "steps_per_sec": n / max(dt, 1e-9)}
+
+
+def _parse_settings(items):
+    out = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        out[name.strip()] = ast.literal_eval(value.strip())
+    return out
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Run an irsim scenario without rendering and report its metrics.")
+    p.add_argument("scenario", nargs="?", choices=sorted(SCENARIOS), help="predefined scenario")
+    p.add_argument("--dir", help="scenario folder (instead of a predefined scenario)")
+    p.add_argument("--yaml", help="world file inside --dir")
+    p.add_argument("--module", help="behavior module inside --dir")
+    p.add_argument("--steps", type=int, help="max steps per run (scenario default otherwise)")
+    p.add_argument("--seed", type=int, default=0, help="seed of the first run; run i uses seed + i")
+    p.add_argument("--repeat", type=int, default=1, help="number of runs")
+    p.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                   help="override a module global, value parsed as a Python literal")
+    args = p.parse_args(argv)
+
+    if args.scenario:
+        folder, yaml, module, steps = SCENARIOS[args.scenario]
+        folder = os.path.join(ROOT, folder)
+    elif args.dir and args.yaml and args.module:
+        folder, yaml, module, steps = args.dir, args.yaml, args.module, 500
+    else:
+        p.error("give a scenario name or all of --dir, --yaml and --module")
+    steps = args.steps or steps
+    settings = _parse_settings(args.set)
+
+    runs = []
+    for i in range(args.repeat):
+        res = run_scenario(folder, yaml, module, steps, seed=args.seed + i, settings=settings)
+        runs.append(res)
+        print(f"[Run {i + 1}/{args.repeat}] seed={args.seed + i} steps={res['steps']} "
+              f"time={res['seconds']:.3f}s steps/sec={res['steps_per_sec']:.1f}")
+
+    if args.repeat > 1:
+        keys = [k for k, v in (runs[0]["metrics"] or {}).items() if isinstance(v, (int, float))]
+        summary = {k: round(float(np.mean([r["metrics"][k] for r in runs])), 4) for k in keys}
+        summary["steps_per_sec"] = round(float(np.mean([r["steps_per_sec"] for r in runs])), 1)
+        print("[Summary] mean over runs:", summary)
+    return runs
+
+
+if __name__ == "__main__":
+    main()
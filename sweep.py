@@ -0,0 +1,213 @@
+"""
+Parameter sweep over module globals, one headless run per (configuration, seed) in a process pool.
+
+    python sweep.py a1-basic --grid "_V0=[0.4, 0.6, 0.8]" --grid "_KW=[0.8, 1.2, 1.6]" --seeds 2
+    python sweep.py a2-aco --uniform "ALPHA=0.5:3" --uniform "BETA=0.5:3" --samples 20 --steps 300
+    python sweep.py a3-rm --grid "GRID_SIZE=[0.25, 0.5]" --grid "EPS=[0.05, 0.1, 0.2]" --out rm_sweep.csv
+
+Rows are appended to --out as runs finish; rerunning the same command skips every run already in
+the file, so an interrupted sweep resumes where it stopped.
+"""
+import argparse
+import ast
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from run_headless import ROOT, SCENARIOS, run_scenario
+
+BASE_COLS = ["key", "scenario", "seed", "steps", "seconds", "steps_per_sec", "error"]
+
+
+# -------------------- Configurations --------------------
+def grid_configs(grid):
+    """grid: name -> list of values. Every combination, in a fixed order."""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def random_configs(ranges, n, seed=0):
+    """ranges: name -> (lo, hi). n configurations drawn uniformly."""
+    rng = random.Random(seed)
+    names = sorted(ranges)
+    return [{k: rng.uniform(*ranges[k]) for k in names} for _ in range(n)]
+
+
+def _job_key(scenario, params, seed, steps):
+    # identifies one run across invocations, for resume
+    return json.dumps([scenario, sorted(params.items()), seed, steps])
+
+
+# -------------------- Worker --------------------
+def _run_job(scenario, params, seed, steps):
+    folder, yaml, module, _ = SCENARIOS[scenario]
+    workdir = tempfile.mkdtemp(prefix="sweep_")         # parallel runs must not share output files
+    with contextlib.redirect_stdout(io.StringIO()):      # modules print progress lines every few steps
+        try:
+            res = run_scenario(os.path.join(ROOT, folder), yaml, module, steps, seed=seed,
+                               settings=params, workdir=workdir)
+            res["error"] = ""
+        except Exception as e:                           # recorded, and retried on resume
+            res = {"metrics": None, "steps": 0, "seconds": 0.0, "steps_per_sec": 0.0,
+                   "error": f"{type(e).__name__}: {e}"}
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return res
+
+
+# -------------------- Results file --------------------
+class _Results:
+    """
+    CSV with one column per field: BASE_COLS, then p:<param> and m:<metric> columns.
+    Rows are flushed as they arrive; torn or failed rows are dropped when the file is reopened.
+    """
+
+    def __init__(self, path, params):
+        self.path = path
+        self.rows = []
+        self.cols = None
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header:
+                    self.cols = header
+                    self.rows = [dict(zip(header, r)) for r in reader if len(r) == len(header)]
+        self.rows = [r for r in self.rows if not r["error"]]
+        self.done = {r["key"] for r in self.rows}
+        self._params = [f"p:{k}" for k in params]
+        self._f = None
+
+    def _open(self, metric_names):
+        cols = BASE_COLS + self._params + [f"m:{k}" for k in metric_names]
+        if self.cols is not None:
+            cols = self.cols + [c for c in cols if c not in self.cols]
+        # rewrite clean (drops torn / failed rows, widens the header if needed), then append
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=cols)
+            w.writeheader()
+            w.writerows(self.rows)
+        os.replace(tmp, self.path)
+        self.cols = cols
+        self._f = open(self.path, "a", encoding="utf-8", newline="")
+        self._w = csv.DictWriter(self._f, fieldnames=cols, extrasaction="ignore")
+
+    def add(self, key, scenario, params, seed, res):
+        metrics = res["metrics"] or {}
+        if self._f is None or any(f"m:{k}" not in self.cols for k in metrics):
+            self.close()
+            self._open(list(metrics))
+        row = {"key": key, "scenario": scenario, "seed": seed, "steps": res["steps"],
+               "seconds": round(res["seconds"], 4), "steps_per_sec": round(res["steps_per_sec"], 2),
+               "error": res["error"]}
+        row.update({f"p:{k}": v for k, v in params.items()})
+        row.update({f"m:{k}": v for k, v in metrics.items()})
+        self._w.writerow(row)
+        self._f.flush()
+        self.rows.append({k: str(v) for k, v in row.items()})
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+def summarize(rows, rank=None, top=10):
+    """Mean of every m:<metric> per parameter set over seeds; sorted by `rank` ("-name": descending)."""
+    groups = {}
+    for r in rows:
+        if r.get("error"):
+            continue
+        params = tuple((k, r[k]) for k in sorted(r) if k.startswith("p:"))
+        groups.setdefault(params, []).append(r)
+    table = []
+    for params, rs in groups.items():
+        entry = {k[2:]: v for k, v in params}
+        for k in rs[0]:
+            if k.startswith("m:") and all(x.get(k) not in (None, "") for x in rs):
+                entry[k[2:]] = round(float(np.mean([float(x[k]) for x in rs])), 4)
+        entry["runs"] = len(rs)
+        table.append(entry)
+    if rank:
+        name, sign = (rank[1:], -1) if rank.startswith("-") else (rank, 1)
+        table.sort(key=lambda e: sign * e.get(name, np.inf * sign))
+    return table[:top] if top else table
+
+
+def sweep(scenario, configs, seeds=1, steps=None, out="sweep.csv", workers=None):
+    """Run every (config, seed) not already in `out`; returns all result rows."""
+    steps = steps or SCENARIOS[scenario][3]
+    params = sorted({k for c in configs for k in c})
+    results = _Results(out, params)
+    jobs = []
+    for c in configs:
+        for seed in range(seeds):
+            key = _job_key(scenario, c, seed, steps)
+            if key not in results.done:
+                jobs.append((key, c, seed))
+    print(f"[Sweep] {scenario}: {len(configs)} configs x {seeds} seeds, "
+          f"{len(jobs)} to run, {len(results.done)} already in {out}")
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = {pool.submit(_run_job, scenario, c, seed, steps): (key, c, seed) for key, c, seed in jobs}
+            for i, fut in enumerate(as_completed(futures), 1):
+                key, c, seed = futures[fut]
+                res = fut.result()
+                results.add(key, scenario, c, seed, res)
+                status = res["error"] or f"{res['steps_per_sec']:.1f} steps/sec"
+                print(f"[Sweep {i}/{len(jobs)}] {c} seed={seed}: {status}")
+    finally:
+        results.close()
+    return results.rows
+
+
+def _parse(items, parse_value):
+    out = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        out[name.strip()] = parse_value(value.strip())
+    return out
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Sweep module globals of a scenario in parallel headless runs.")
+    p.add_argument("scenario", choices=sorted(SCENARIOS))
+    p.add_argument("--grid", action="append", default=[], metavar="NAME=[v1, v2, ...]",
+                   help="values to try for one global (Python literal list)")
+    p.add_argument("--uniform", action="append", default=[], metavar="NAME=LO:HI",
+                   help="sample one global uniformly in [LO, HI]")
+    p.add_argument("--samples", type=int, default=10, help="number of random configurations (--uniform)")
+    p.add_argument("--sample-seed", type=int, default=0)
+    p.add_argument("--seeds", type=int, default=1, help="runs per configuration, seeds 0..N-1")
+    p.add_argument("--steps", type=int, help="max steps per run (scenario default otherwise)")
+    p.add_argument("--workers", type=int, help="processes (all cores by default)")
+    p.add_argument("--out", default="sweep.csv", help="results file, appended to and resumed from")
+    p.add_argument("--rank", help="metric to sort the summary by; prefix with - for descending")
+    p.add_argument("--top", type=int, default=10)
+    args = p.parse_args(argv)
+
+    grid = _parse(args.grid, ast.literal_eval)
+    ranges = _parse(args.uniform, lambda v: tuple(float(x) for x in v.split(":")))
+    if ranges:
+        configs = [dict(g, **r) for r in random_configs(ranges, args.samples, args.sample_seed)
+                   for g in grid_configs(grid)]
+    else:
+        configs = grid_configs(grid)
+
+    rows = sweep(args.scenario, configs, args.seeds, args.steps, args.out, args.workers)
+    for entry in summarize(rows, args.rank, args.top):
+        print("[Summary]", entry)
+
+
+if __name__ == "__main__":
+    main()